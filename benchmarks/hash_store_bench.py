@@ -0,0 +1,216 @@
+"""HashManager throughput and latency benchmark against a local S3 stand-in.
+
+Starts a moto server (``pip install "moto[server]"``) unless ``--endpoint-url``
+points at an already running S3-compatible endpoint. For every store size and
+layout it seeds the store, then runs N concurrent workers, each with its own
+``HashManager`` as separate proof containers would have, issuing a mix of
+``contains_hash``, ``add_hash`` and ``remove_hash`` calls (plus a full
+``get_remote_hashes`` read per worker).
+
+Reported per layout and size: ops/sec, p50/p99 latency per operation, bytes
+sent and received, and lost updates, i.e. hashes whose ``add_hash`` returned
+True but which are missing from the store afterwards because a concurrent
+writer overwrote them.
+
+Usage:
+    python benchmarks/hash_store_bench.py --sizes 10000,100000 --workers 8 --ops 50
+"""
+import argparse
+import hashlib
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from my_proof.hash_manager import SHARDED_LAYOUT, SINGLE_LAYOUT, HashManager  # noqa: E402
+
+BUCKET = 'hash-store-bench'
+
+
+class Traffic:
+    """Counts request and response payload bytes across S3 clients."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.received = 0
+
+    def attach(self, client):
+        client.meta.events.register('before-send.s3.*', self._on_send)
+        client.meta.events.register('after-call.s3.*', self._on_response)
+
+    def _on_send(self, request, **kwargs):
+        size = int(request.headers.get('Content-Length') or 0)
+        with self.lock:
+            self.sent += size
+
+    def _on_response(self, http_response, **kwargs):
+        size = int(http_response.headers.get('content-length') or 0) if http_response.status_code in (200, 206) else 0
+        with self.lock:
+            self.received += size
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_moto_server():
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'moto.server', '-p', str(port)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("moto server did not start")
+
+
+def make_hash(value):
+    return hashlib.sha256(str(value).encode()).hexdigest()
+
+
+def make_manager(key, layout, prefix_len, traffic=None):
+    manager = HashManager(BUCKET, key, 'bench', 'bench', layout=layout, shard_prefix_len=prefix_len)
+    if traffic is not None:
+        traffic.attach(manager.s3_client)
+    return manager
+
+
+def seed(key, layout, prefix_len, size):
+    hashes = [make_hash(f"seed-{i}") for i in range(size)]
+    single = make_manager(key, SINGLE_LAYOUT, prefix_len)
+    single.update_remote_hashes(hashes)
+    if layout == SHARDED_LAYOUT:
+        make_manager(key, SHARDED_LAYOUT, prefix_len).migrate_to_sharded(prefix_len)
+    return hashes
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return float('nan')
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_worker(worker_id, key, layout, prefix_len, ops, seeded, traffic, seed_value):
+    rng = random.Random(seed_value + worker_id)
+    manager = make_manager(key, layout, prefix_len, traffic)
+    latencies = {'get_remote_hashes': [], 'contains_hash': [], 'add_hash': [], 'remove_hash': []}
+    added = []
+
+    start = time.perf_counter()
+    manager.get_remote_hashes()
+    latencies['get_remote_hashes'].append(time.perf_counter() - start)
+
+    for i in range(ops):
+        roll = rng.random()
+        start = time.perf_counter()
+        if roll < 0.5:
+            manager.contains_hash(rng.choice(seeded))
+            op = 'contains_hash'
+        elif roll < 0.9:
+            new_hash = make_hash(f"worker-{worker_id}-{i}")
+            if manager.add_hash(new_hash):
+                added.append(new_hash)
+            op = 'add_hash'
+        else:
+            manager.remove_hash(make_hash(f"missing-{worker_id}-{i}"))
+            op = 'remove_hash'
+        latencies[op].append(time.perf_counter() - start)
+    return latencies, added
+
+
+def bench(layout, size, workers, ops, prefix_len, seed_value):
+    key = f"bench/{layout}-{size}/hashes.json"
+    seeded = seed(key, layout, prefix_len, size)
+
+    traffic = Traffic()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(
+            lambda w: run_worker(w, key, layout, prefix_len, ops, seeded, traffic, seed_value),
+            range(workers),
+        ))
+    elapsed = time.perf_counter() - start
+
+    latencies = {}
+    added = []
+    for worker_latencies, worker_added in results:
+        added.extend(worker_added)
+        for op, samples in worker_latencies.items():
+            latencies.setdefault(op, []).extend(samples)
+
+    stored = set(make_manager(key, layout, prefix_len).get_remote_hashes())
+    total_ops = sum(len(samples) for samples in latencies.values())
+    return {
+        'layout': layout,
+        'size': size,
+        'ops_per_sec': total_ops / elapsed,
+        'latencies': latencies,
+        'sent': traffic.sent,
+        'received': traffic.received,
+        'acknowledged_adds': len(added),
+        'lost_updates': sum(1 for h in added if h not in stored),
+    }
+
+
+def report(result):
+    print(f"\n{result['layout']} layout, {result['size']} hashes")
+    print(f"  throughput: {result['ops_per_sec']:.1f} ops/sec")
+    for op, samples in result['latencies'].items():
+        if samples:
+            print(f"  {op:<18} n={len(samples):<5} p50={percentile(samples, 0.5) * 1000:8.1f} ms"
+                  f"  p99={percentile(samples, 0.99) * 1000:8.1f} ms")
+    print(f"  bytes sent: {result['sent']:,}  received: {result['received']:,}")
+    print(f"  lost updates: {result['lost_updates']} of {result['acknowledged_adds']} acknowledged adds")
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--sizes', default='10000,100000',
+                            help="comma-separated store sizes to seed")
+    arg_parser.add_argument('--workers', type=int, default=8)
+    arg_parser.add_argument('--ops', type=int, default=50, help="operations per worker")
+    arg_parser.add_argument('--layouts', default=f"{SINGLE_LAYOUT},{SHARDED_LAYOUT}")
+    arg_parser.add_argument('--prefix-len', type=int, default=2)
+    arg_parser.add_argument('--endpoint-url', help="use a running S3 endpoint instead of starting moto")
+    arg_parser.add_argument('--seed', type=int, default=0)
+    args = arg_parser.parse_args()
+
+    server = None
+    endpoint_url = args.endpoint_url
+    if endpoint_url is None:
+        server, endpoint_url = start_moto_server()
+    os.environ['AWS_ENDPOINT_URL'] = endpoint_url
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+    try:
+        make_manager('bench/setup.json', SINGLE_LAYOUT, args.prefix_len).s3_client.create_bucket(Bucket=BUCKET)
+        print(f"S3 endpoint: {endpoint_url}, workers: {args.workers}, ops/worker: {args.ops}")
+        for size in (int(s) for s in args.sizes.split(',')):
+            for layout in args.layouts.split(','):
+                report(bench(layout, size, args.workers, args.ops, args.prefix_len, args.seed))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Cold-start import benchmark for the proof package.
+
+Every sample runs in a fresh interpreter so nothing is cached in
+``sys.modules``. The script fails (exit code 1) when the median import time
+exceeds the budget, or when the plain location-history path pulls in a heavy
+module that should only load on demand.
+
+Usage:
+    python benchmarks/import_budget.py [--runs 7] [--budget-ms 300]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_FILE = os.path.join(REPO_ROOT, 'my_proof', 'location-history.json')
+
+# Modules that must never be imported by a local location-history run
+LAZY_MODULES = ('boto3', 'botocore', 's3transfer', 'dateutil')
+
+PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import my_proof.proof
+import_ms = (time.perf_counter() - t0) * 1000
+with open(sys.argv[1], 'r', encoding='utf-8') as f:
+    data = json.load(f)
+t1 = time.perf_counter()
+my_proof.proof.Quality(data)
+run_ms = (time.perf_counter() - t1) * 1000
+loaded = sorted({m.split('.')[0] for m in sys.modules} & set(sys.argv[2].split(',')))
+sys.stdout.write('\\n' + json.dumps({'import_ms': import_ms, 'run_ms': run_ms, 'loaded': loaded}))
+"""
+
+
+def run_probe():
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE, SAMPLE_FILE, ','.join(LAZY_MODULES)],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def top_imports(limit=10):
+    """Return the slowest cumulative imports reported by ``-X importtime``."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import my_proof.proof'],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--runs', type=int, default=7)
+    arg_parser.add_argument('--budget-ms', type=float,
+                            default=float(os.environ.get('IMPORT_BUDGET_MS', 300)))
+    args = arg_parser.parse_args()
+
+    samples = [run_probe() for _ in range(args.runs)]
+    import_ms = statistics.median(s['import_ms'] for s in samples)
+    run_ms = statistics.median(s['run_ms'] for s in samples)
+    loaded = sorted({m for s in samples for m in s['loaded']})
+
+    print(f"import my_proof.proof: median {import_ms:.1f} ms over {args.runs} runs "
+          f"(budget {args.budget_ms:.0f} ms)")
+    print(f"Quality() on sample history: median {run_ms:.1f} ms")
+    print("Slowest imports (cumulative us):")
+    for cumulative, name in top_imports():
+        print(f"  {cumulative:>8}  {name}")
+
+    failed = False
+    if loaded:
+        print(f"FAIL: lazily loaded modules imported on the plain path: {', '.join(loaded)}")
+        failed = True
+    if import_ms > args.budget_ms:
+        print(f"FAIL: import time {import_ms:.1f} ms exceeds budget of {args.budget_ms:.0f} ms")
+        failed = True
+    if not failed:
+        print("OK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
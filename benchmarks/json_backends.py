@@ -0,0 +1,72 @@
+"""Decode and encode throughput of each installed JSON backend.
+
+For every input file it times ``loads`` of the raw bytes and ``dumps`` of
+the decoded document with each backend ``my_proof.json_backend`` can use
+here (install ``orjson`` or ``pysimdjson`` to compare them with the stdlib),
+and checks that every backend decodes exactly what the stdlib does.
+
+Usage:
+    python benchmarks/json_backends.py [history.json ...] [--runs 5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from my_proof.json_backend import available_backends, get_backend  # noqa: E402
+
+SAMPLE_FILE = os.path.join(REPO_ROOT, 'my_proof', 'location-history.json')
+
+
+def timed(function, argument, runs):
+    """Return the median duration of ``runs`` calls and the last result."""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function(argument)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), result
+
+
+def bench(path, runs):
+    with open(path, 'rb') as f:
+        raw = f.read()
+    megabytes = len(raw) / (1 << 20)
+    reference = repr(get_backend('json').loads(raw))
+    print(f"\n{os.path.basename(path)}: {megabytes:.1f} MB")
+    failed = False
+    for name in available_backends():
+        backend = get_backend(name)
+        decode_s, document = timed(backend.loads, raw, runs)
+        encode_s, encoded = timed(backend.dumps, document, runs)
+        identical = repr(document) == reference
+        print(f"  {name:<9} decode {decode_s * 1000:8.1f} ms {megabytes / decode_s:7.1f} MB/s   "
+              f"encode {encode_s * 1000:8.1f} ms {len(encoded) / (1 << 20) / encode_s:7.1f} MB/s   "
+              f"{'identical' if identical else 'DIFFERS from json'}")
+        failed = failed or not identical
+    return failed
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('files', nargs='*', default=[SAMPLE_FILE])
+    arg_parser.add_argument('--runs', type=int, default=5)
+    args = arg_parser.parse_args()
+
+    print(f"Installed backends: {', '.join(available_backends())}")
+    failed = False
+    for path in args.files:
+        failed = bench(path, args.runs) or failed
+    if failed:
+        print("FAIL: a backend decoded differently from json")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
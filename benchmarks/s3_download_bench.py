@@ -0,0 +1,107 @@
+"""Ranged parallel S3 download benchmark against a local S3 stand-in.
+
+Starts a moto server (``pip install "moto[server]"``) unless ``--endpoint-url``
+points at an already running S3-compatible endpoint, uploads a synthetic JSON
+object of ``--size-mb`` and downloads it with a single ``get_object`` stream
+and with ``download_object`` for every chunk size and concurrency given. Each
+parallel download must match the object byte for byte, and
+``download_json_from_s3`` must decode it to the uploaded document.
+
+moto serves every range request by reading the whole object on one Python
+process, so against it the benchmark checks correctness and client overhead;
+point ``--endpoint-url`` at a real endpoint to measure the throughput gain.
+
+Usage:
+    python benchmarks/s3_download_bench.py --size-mb 64 --chunks-mb 1,8 --concurrency 1,4,8
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from hash_store_bench import start_moto_server  # noqa: E402
+from my_proof.aws_interaction import download_json_from_s3, download_object, s3_client  # noqa: E402
+
+BUCKET = 's3-download-bench'
+KEY = 'bench/reference.json'
+
+
+def make_document(size_bytes):
+    """A list of poison-file style records of roughly ``size_bytes`` once encoded."""
+    record_bytes = len(json.dumps({'uniqueID': 'x' * 32, 'chosen': 'model-a', 'score': 0.5}))
+    return [{'uniqueID': f"{i:032x}", 'chosen': f"model-{'ab'[i % 2]}", 'score': i / 7}
+            for i in range(max(1, size_bytes // (record_bytes + 2)))]
+
+
+def timed(function, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), result
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--size-mb', type=float, default=64)
+    arg_parser.add_argument('--chunks-mb', default='1,8', help="comma-separated range sizes")
+    arg_parser.add_argument('--concurrency', default='1,4,8', help="comma-separated thread counts")
+    arg_parser.add_argument('--runs', type=int, default=3)
+    arg_parser.add_argument('--endpoint-url', help="use a running S3 endpoint instead of starting moto")
+    args = arg_parser.parse_args()
+
+    server = None
+    endpoint_url = args.endpoint_url
+    if endpoint_url is None:
+        server, endpoint_url = start_moto_server()
+    os.environ['AWS_ENDPOINT_URL'] = endpoint_url
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+    failed = False
+    try:
+        concurrencies = [int(c) for c in args.concurrency.split(',')]
+        s3 = s3_client('bench', 'bench', max(concurrencies))
+        s3.create_bucket(Bucket=BUCKET)
+        document = make_document(int(args.size_mb * (1 << 20)))
+        payload = json.dumps(document).encode('utf-8')
+        s3.put_object(Bucket=BUCKET, Key=KEY, Body=payload)
+        megabytes = len(payload) / (1 << 20)
+        print(f"S3 endpoint: {endpoint_url}, object: {megabytes:.1f} MB")
+
+        seconds, _ = timed(lambda: s3.get_object(Bucket=BUCKET, Key=KEY)['Body'].read(), args.runs)
+        print(f"  single get_object            {seconds * 1000:8.1f} ms {megabytes / seconds:7.1f} MB/s")
+        for chunk_mb in (float(c) for c in args.chunks_mb.split(',')):
+            chunk_bytes = int(chunk_mb * (1 << 20))
+            for concurrency in concurrencies:
+                seconds, (content, _) = timed(
+                    lambda: download_object(s3, BUCKET, KEY, chunk_bytes, concurrency), args.runs)
+                identical = content == payload
+                failed = failed or not identical
+                print(f"  chunk {chunk_mb:5g} MB x {concurrency:<3} threads {seconds * 1000:8.1f} ms "
+                      f"{megabytes / seconds:7.1f} MB/s   {'identical' if identical else 'DIFFERS'}")
+
+        parsed = download_json_from_s3(BUCKET, KEY, 'bench', 'bench', chunk_bytes=1 << 20,
+                                       max_concurrency=max(concurrencies))
+        if parsed != document:
+            print("download_json_from_s3 did not return the uploaded document")
+            failed = True
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if failed:
+        print("FAIL")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
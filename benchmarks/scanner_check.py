@@ -0,0 +1,239 @@
+"""Randomized differential check of the hand-written JSON scanners.
+
+The streaming reader decodes history entries out of a sliding window, so a
+value can be split at any character by a block boundary. Random documents
+are written with random layouts and read back with ``iter_history`` at small
+block sizes; every entry must equal what ``json.loads`` makes of the file.
+The scanners that find the end of a value without decoding it (the reader's
+``skip`` behind ``load_projected`` and ``history_offset``, and
+``split_array``) are checked the same way, including nesting too deep to
+balance in bulk, and ``parse_geo_strings`` is checked against
+``parse_geo_string`` value by value.
+The script fails (exit code 1) on the first mismatch or error of each check.
+
+Usage:
+    python benchmarks/scanner_check.py [--cases 300] [--seed 0]
+"""
+import argparse
+import json
+import math
+import mmap
+import os
+import random
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from my_proof.geo import parse_geo_string, parse_geo_strings  # noqa: E402
+from my_proof.parallel_decode import split_array  # noqa: E402
+from my_proof.streaming import history_offset, iter_history, load_projected  # noqa: E402
+
+# Strings with the characters the scanners treat specially
+STRINGS = ('', 'a', 'geo:51.5,-0.12', 'a]}[{,:', '"', '\\', '\\"', 'ünï"cödé', ' ', '[]{}"\\')
+
+
+def random_number(rng):
+    kind = rng.randrange(5)
+    if kind == 0:
+        return rng.randint(-10, 10)
+    if kind == 1:
+        return rng.randint(-10 ** 20, 10 ** 20)
+    if kind == 2:
+        return rng.uniform(-1e3, 1e3)
+    if kind == 3:
+        return rng.uniform(-1, 1) * 10 ** rng.randint(-30, 30)
+    return rng.choice((0, -0.0, 0.5, 1e-7, 12.5))
+
+
+def random_value(rng, depth):
+    kind = rng.randrange(8 if depth > 0 else 4)
+    if kind == 0:
+        return random_number(rng)
+    if kind == 1:
+        return rng.choice(STRINGS)
+    if kind == 2:
+        return rng.choice((True, False, None))
+    if kind == 3:
+        return ''.join(rng.choice('ab"\\[]{},: 0') for _ in range(rng.randint(0, 12)))
+    if kind < 6:
+        return [random_value(rng, depth - 1) for _ in range(rng.randint(0, 4))]
+    return {rng.choice(STRINGS) + str(i): random_value(rng, depth - 1) for i in range(rng.randint(0, 4))}
+
+
+def deep_value(rng, depth):
+    """A value nested ``depth`` containers deep, with bracket-laden strings on the way."""
+    value = rng.choice(STRINGS)
+    for _ in range(depth):
+        if rng.random() < 0.5:
+            value = [rng.choice(STRINGS), value, random_number(rng)]
+        else:
+            value = {'k': value, rng.choice(STRINGS) + 'x': rng.choice(STRINGS)}
+    return value
+
+
+def random_export(rng):
+    """An Android-shaped document with large, sometimes deeply nested, unread sections."""
+    entries = [random_value(rng, 3) for _ in range(rng.randint(0, 20))]
+    if rng.random() < 0.3:
+        entries.append(deep_value(rng, rng.randint(100, 300)))
+    raw = [random_value(rng, 3) for _ in range(rng.randint(0, 40))]
+    if rng.random() < 0.5:
+        raw.append(deep_value(rng, rng.randint(100, 300)))
+    document = {'rawSignals': raw, 'semanticSegments': entries, 'userLocationProfile': random_value(rng, 3)}
+    if rng.random() < 0.5:
+        document = dict(reversed(list(document.items())))
+    return document
+
+
+def project(value, fields):
+    """What ``load_projected`` should return, computed on the decoded document."""
+    if fields is True:
+        return value
+    if isinstance(value, dict):
+        return {k: project(v, fields[k]) for k, v in value.items() if k in fields}
+    if isinstance(value, list):
+        return [project(v, fields) for v in value]
+    return value
+
+
+def same_float(a, b):
+    return a == b or (math.isnan(a) and math.isnan(b))
+
+
+def write_document(path, document, rng):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(document, f, ensure_ascii=rng.random() < 0.5, indent=rng.choice((None, 0, 1, 4)),
+                  separators=rng.choice(((',', ':'), (', ', ': '), None)))
+
+
+def check_iter_history(path, rng, cases):
+    """Entries streamed at small block sizes equal the ``json.loads`` result."""
+    for case in range(cases):
+        entries = [random_value(rng, 3) for _ in range(rng.randint(0, 20))]
+        if rng.random() < 0.5:
+            key, document = 'semanticSegments', {'rawSignals': random_value(rng, 3), 'semanticSegments': entries}
+        else:
+            key, document = None, entries
+        write_document(path, document, rng)
+        with open(path, 'r', encoding='utf-8') as f:
+            expected = json.load(f)
+        if key is not None:
+            expected = expected[key]
+        block_size = rng.choice((1, 2, 3, 5, 7, 16, 64, 1 << 20))
+        if list(iter_history(path, key, block_size)) != expected:
+            return f"case {case}: block size {block_size}"
+    # A number cut by every possible block boundary (e.g. "12." + "5")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[12.5, -0.25e-3, 123456789012345678901, 1E+2]')
+    for block_size in range(1, 48):
+        if list(iter_history(path, None, block_size)) != [12.5, -0.25e-3, 123456789012345678901, 1E+2]:
+            return f"split number: block size {block_size}"
+    return None
+
+
+def check_skip(path, rng, cases):
+    """Projected loads and the history offset agree with ``json.loads``."""
+    for case in range(cases):
+        document = random_export(rng)
+        write_document(path, document, rng)
+        with open(path, 'r', encoding='utf-8') as f:
+            expected = json.load(f)
+        block_size = rng.choice((3, 64, 4096, 1 << 20))
+        fields = rng.choice(({'semanticSegments': True}, {'semanticSegments': {'k': True, 'a0': True}},
+                             {'userLocationProfile': True, 'rawSignals': {'k': True}}))
+        if load_projected(path, fields, block_size) != project(expected, fields):
+            return f"case {case}: load_projected, block size {block_size}"
+        with open(path, 'rb') as f:
+            data = f.read()
+        offset = history_offset(path, 'semanticSegments', block_size)
+        text = data[offset:].decode('utf-8')
+        if json.JSONDecoder().raw_decode(text)[0] != expected['semanticSegments']:
+            return f"case {case}: history_offset, block size {block_size}"
+    return None
+
+
+def check_split_array(path, rng, cases):
+    """The byte ranges of ``split_array`` decode to the array, element for element."""
+    for case in range(cases):
+        document = random_export(rng)
+        write_document(path, document, rng)
+        with open(path, 'r', encoding='utf-8') as f:
+            expected = json.load(f)['semanticSegments']
+        chunk_bytes = rng.choice((1, 10, 100, 5000, 8 << 20))
+        start = history_offset(path, 'semanticSegments')
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            ranges = list(split_array(buf, start, chunk_bytes))
+            entries = [entry for begin, end in ranges for entry in json.loads(b'[' + buf[begin:end] + b']')]
+        if entries != expected:
+            return f"case {case}: chunk bytes {chunk_bytes}"
+        if any(end <= begin for begin, end in ranges) or any(a[1] >= b[0] for a, b in zip(ranges, ranges[1:])):
+            return f"case {case}: ranges out of order or empty"
+    return None
+
+
+def random_geo_string(rng):
+    kind = rng.randrange(8)
+    lat, lng = (rng.choice((random_number(rng), rng.uniform(-90, 90))) for _ in range(2))
+    if kind < 3:
+        return f"geo:{lat},{lng}"
+    if kind == 3:
+        return f"{lat}°, {lng}°"
+    if kind == 4:
+        return rng.choice(('', 'geo:', 'geo:1', 'geo:1,2,3', 'geo:01,2', 'geo:1-2,3', 'geo:nan,1',
+                           'geo:1e999,2', 'geo:' + '9' * 400 + ',1', 'geo:1,2\ngeo:3,4', 'geo: 1 ,2 '))
+    if kind == 5:
+        return rng.choice((None, 12, 1.5, ['geo:1,2'], {'geo': 1}))
+    return ''.join(rng.choice('geo:0123456789.,-+eE° \n') for _ in range(rng.randint(0, 16)))
+
+
+def check_parse_geo_strings(path, rng, cases):
+    """``parse_geo_strings`` agrees with ``parse_geo_string`` value by value."""
+    for case in range(cases):
+        values = [random_geo_string(rng) for _ in range(rng.randint(0, 50))]
+        if rng.random() < 0.5:
+            # Mostly regular batches take the bulk path
+            values = [f"geo:{rng.uniform(-90, 90)},{rng.uniform(-180, 180)}" for _ in range(100)] + values[:1]
+        lats, lngs, valid = parse_geo_strings(values)
+        for i, value in enumerate(values):
+            point = parse_geo_string(value) if isinstance(value, str) else None
+            if bool(valid[i]) != (point is not None):
+                return f"case {case}: validity of {value!r}"
+            if point is not None and not (same_float(lats[i], point[0]) and same_float(lngs[i], point[1])):
+                return f"case {case}: {value!r} read as {(lats[i], lngs[i])}, expected {point}"
+    return None
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--cases', type=int, default=300)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    args = arg_parser.parse_args()
+
+    checks = (
+        ('iter_history', check_iter_history),
+        ('skip', check_skip),
+        ('split_array', check_split_array),
+        ('parse_geo_strings', check_parse_geo_strings),
+    )
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'document.json')
+        for name, check in checks:
+            try:
+                error = check(path, random.Random(args.seed), args.cases)
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            print(f"  {name:<20} {'FAIL: ' + error if error else 'ok'}")
+            failed = failed or error is not None
+
+    if failed:
+        print("FAIL")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -24,6 +24,26 @@ def load_config() -> Dict[str, Any]:
     config = {
         'dlp_id': 22,#to be changed
         'input_dir': INPUT_DIR,
+        # Optional RSS ceiling for validation; segments spill to disk beyond it
+        'memory_budget_mb': float(os.environ['MEMORY_BUDGET_MB']) if os.environ.get('MEMORY_BUDGET_MB') else None,
+        # Optional directory to emit memory-mappable segment caches for re-scoring
+        'segment_cache_dir': os.environ.get('SEGMENT_CACHE_DIR'),
+        # Decode the input on this many worker processes (0 or 1 decodes in-process)
+        'decode_workers': int(os.environ.get('DECODE_WORKERS', 0)),
+        # Estimate the per-entry ratio checks from a random sample (in-memory inputs only)
+        'approximate_validation': os.environ.get('APPROXIMATE_VALIDATION', '').lower() in ('1', 'true', 'yes'),
+        # Optional S3 hash store for the uniqueness check (credentials come from the AWS_* env vars)
+        'hash_bucket': os.environ.get('HASH_BUCKET'),
+        'hash_file_key': os.environ.get('HASH_FILE_KEY'),
+        'hash_store_layout': os.environ.get('HASH_STORE_LAYOUT', 'single'),
+        'hash_shard_prefix_len': int(os.environ.get('HASH_SHARD_PREFIX_LEN', 2)),
+        # Optional on-disk read-through cache of the hash store, revalidated by ETag after the TTL
+        'hash_cache_dir': os.environ.get('HASH_CACHE_DIR'),
+        'hash_cache_ttl_s': float(os.environ.get('HASH_CACHE_TTL_S', 0)),
+        'remote_timeout_s': float(os.environ.get('REMOTE_TIMEOUT_S', 30)),
+        # S3 objects larger than one chunk are downloaded as concurrent byte ranges
+        'download_chunk_mb': float(os.environ.get('S3_DOWNLOAD_CHUNK_MB', 8)),
+        'download_concurrency': int(os.environ.get('S3_DOWNLOAD_CONCURRENCY', 8)),
     }
     logging.info(f"Using config: {json.dumps(config, indent=2)}")
     return config
@@ -1,23 +1,44 @@
 import json
 import math
 from datetime import datetime
-from typing import List, Dict, Any, Optional, Union
-from collections import Counter
-from dateutil import parser
+from typing import Iterable, List, Dict, Any, Optional, Tuple, Union
+
+from my_proof.segments import (
+    GEO_ACTIVITY, GEO_VISIT, LEVEL_CHECKED, NAN, RUN, SPEED_CHECKED, WALK, CheckCounts,
+    SegmentStore, count_checks, segment_fingerprint, segment_row, speed_between, to_micros,
+)
+from my_proof.sampling import validate_sampled
+from my_proof.segment_cache import write_segment_cache
 
 class AndroidLocationHistoryValidator:
+    data_format = 'android'
+    # Members of the export the checks read, as a streaming.Projection; the
+    # rawSignals and userLocationProfile sections are skipped unparsed.
+    # Segments are decoded whole, which in C is cheaper than projecting away
+    # their few unused members in Python
+    projection = {'semanticSegments': True}
+    # Segment members whose segments are visits or activities (GEO flags)
+    geo_keys = ("placeVisit", "activitySegment")
+
     def __init__(self, max_speed_m_s: float = 44.44, allowed_hierarchy_levels: List[int] = [0, 1, 2]):
         self.max_speed_m_s = max_speed_m_s
         self.allowed_hierarchy_levels = allowed_hierarchy_levels
         self.max_walk_speed = 1.4
         self.max_run_speed = 3.5
+        self.max_continuity_gap_m = 1000.0
         
     @staticmethod
     def parse_time(time_str: str) -> Optional[datetime]:
         if not time_str:
             return None
         try:
-            # Android format uses ISO 8601 with timezone
+            # Fast path: exports use ISO 8601, which the stdlib parses natively
+            return datetime.fromisoformat(time_str)
+        except (TypeError, ValueError):
+            pass
+        try:
+            # dateutil is only imported for the odd non-ISO timestamp
+            from dateutil import parser
             return parser.parse(time_str)
         except Exception:
             return None
@@ -41,199 +62,244 @@ class AndroidLocationHistoryValidator:
         dt = (t2 - t1).total_seconds()
         return distance_meters / dt if dt > 0 else 0.0
 
-    def check_time_order(self, data: List[Dict[str, Any]]) -> float:
-        if not data:
-            return 1.0
-            
-        issues = 0
-        total_checks = len(data) * 2 - 1  # Two checks per entry plus transitions
-        
-        for i, entry in enumerate(data):
-            start = self.parse_time(entry.get("startTime"))
-            end = self.parse_time(entry.get("endTime"))
-            if start and end and end < start:
-                issues += 1
-            if i < len(data) - 1:
-                next_start = self.parse_time(data[i + 1].get("startTime"))
-                if end and next_start and next_start < end:
-                    issues += 1
-        
-        return 1.0 - (issues / total_checks)
+    @staticmethod
+    def parse_e7_location(location: Optional[Dict[str, Any]]) -> Optional[tuple]:
+        if not isinstance(location, dict):
+            return None
+        try:
+            lat = float(location["latitudeE7"]) / 1e7
+            lng = float(location["longitudeE7"]) / 1e7
+        except (KeyError, TypeError, ValueError):
+            return None
+        if -90 <= lat <= 90 and -180 <= lng <= 180:
+            return lat, lng
+        return None
 
-    def check_suspicious_speed(self, data: List[Dict[str, Any]]) -> float:
-        if not data:
-            return 1.0
-            
-        valid_entries = 0
-        total_checked = 0
-        
-        for entry in data:
-            if "activities" in entry and entry["activities"]:
-                total_checked += 1
-                distance = entry.get("distance", 0)
-                start_time = self.parse_time(entry.get("startTime"))
-                end_time = self.parse_time(entry.get("endTime"))
+    def segment_row(self, entry: Dict[str, Any]) -> tuple:
+        """Normalize one segment into a ``segments.COLUMNS`` row."""
+        start = to_micros(self.parse_time(entry.get("startTime")))
+        end = to_micros(self.parse_time(entry.get("endTime")))
+        flags = 0
+        distance = NAN
+        speed = travel_speed = 0.0
+        prob_valid = prob_total = 0
+        confidence = NAN
+        path_valid = path_total = 0
+        start_lat = start_lng = end_lat = end_lng = NAN
+
+        if "activities" in entry and entry["activities"]:
+            flags |= SPEED_CHECKED
+            distance = entry.get("distance", 0)
+            try:
+                dist_m = float(distance) if distance else 0.0
+            except ValueError:
+                dist_m = 0.0
+            distance = dist_m
+            speed = speed_between(dist_m, start, end)
+
+        if "activities" in entry:
+            for activity in entry["activities"]:
+                if "probability" in activity:
+                    prob_total += 1
+                    try:
+                        prob = float(activity["probability"])
+                        if 0.0 <= prob <= 1.0:
+                            prob_valid += 1
+                    except ValueError:
+                        pass
 
+        if "placeVisit" in entry:
+            flags |= GEO_VISIT
+            place = entry["placeVisit"].get("location", {})
+            place_point = self.parse_e7_location(place)
+            if place_point:
+                start_lat, start_lng = end_lat, end_lng = place_point
+            if "locationConfidence" in place:
+                flags |= LEVEL_CHECKED
                 try:
-                    dist_m = float(distance) if distance else 0.0
+                    confidence = float(place["locationConfidence"])
                 except ValueError:
-                    dist_m = 0.0
-
-                speed = self.calc_speed(dist_m, start_time, end_time)
-                if speed <= self.max_speed_m_s:
-                    valid_entries += 1
-        
-        return valid_entries / total_checked if total_checked > 0 else 1.0
+                    pass
 
-    def check_inconsistent_probabilities(self, data: List[Dict[str, Any]]) -> float:
-        if not data:
-            return 1.0
-            
-        valid_probs = 0
-        total_probs = 0
-        
-        for entry in data:
-            if "activities" in entry:
-                for activity in entry["activities"]:
-                    if "probability" in activity:
-                        total_probs += 1
-                        try:
-                            prob = float(activity["probability"])
-                            if 0.0 <= prob <= 1.0:
-                                valid_probs += 1
-                        except ValueError:
-                            pass
-        
-        return valid_probs / total_probs if total_probs > 0 else 1.0
+        if "activitySegment" in entry:
+            flags |= GEO_ACTIVITY
+            segment = entry["activitySegment"]
+            start_point = self.parse_e7_location(segment.get("startLocation"))
+            end_point = self.parse_e7_location(segment.get("endLocation"))
+            if start_point and end_point:
+                (start_lat, start_lng), (end_lat, end_lng) = start_point, end_point
+            waypoints = segment.get("waypointPath", {}).get("waypoints", [])
+            for waypoint in waypoints:
+                path_total += 2  # Two checks per point: lat and lng
 
-    def check_hierarchy_levels(self, data: List[Dict[str, Any]]) -> float:
-        if not data:
-            return 1.0
-        valid_levels = 0
-        total_checked = 0
-        
-        for entry in data:
-            if "placeVisit" in entry:
-                place = entry["placeVisit"].get("location", {})
-                if "locationConfidence" in place:
-                    total_checked += 1
+                if "latE7" in waypoint and "lngE7" in waypoint:
                     try:
-                        confidence = float(place["locationConfidence"])
-                        if 0.0 <= confidence <= 1.0:
-                            valid_levels += 1
+                        lat = float(waypoint["latE7"]) / 1e7
+                        lng = float(waypoint["lngE7"]) / 1e7
+                        if -90 <= lat <= 90 and -180 <= lng <= 180:
+                            path_valid += 2
                     except ValueError:
                         pass
-        
-        return valid_levels / total_checked if total_checked > 0 else 1.0
 
-    def check_waypoints(self, data: List[Dict[str, Any]]) -> float:
-        if not data:
-            return 1.0
-            
-        valid_points = 0
-        total_points = 0
-        
+            activity_type = segment.get("activityType", "").lower()
+            if activity_type and ("walking" in activity_type or "running" in activity_type):
+                if "walking" in activity_type:
+                    flags |= WALK
+                if "running" in activity_type:
+                    flags |= RUN
+                try:
+                    dist_m = float(segment.get("distance", 0))
+                except ValueError:
+                    dist_m = 0.0
+                travel_speed = speed_between(
+                    dist_m,
+                    to_micros(self.parse_time(segment.get("startTime"))),
+                    to_micros(self.parse_time(segment.get("endTime"))),
+                )
+
+        return segment_row(start=start, end=end, flags=flags, distance=distance, speed=speed,
+                           travel_speed=travel_speed, prob_valid=prob_valid,
+                           prob_total=prob_total, confidence=confidence,
+                           path_valid=path_valid, path_total=path_total,
+                           start_lat=start_lat, start_lng=start_lng, end_lat=end_lat, end_lng=end_lng,
+                           fingerprint=self.fingerprint(entry, start, end))
+
+    def fingerprint(self, entry: Dict[str, Any], start: int, end: int) -> int:
+        """Identity hash of a segment's visit or activity (0 for neither) for the duplicate check."""
+        if "placeVisit" in entry:
+            place = entry["placeVisit"].get("location", {})
+            place_id = place.get("placeId")
+            if place_id is not None:
+                return segment_fingerprint("visit", place_id, start, end)
+            return segment_fingerprint("visit", None, start, end,
+                                       coords=self.parse_e7_location(place) or (NAN, NAN))
+        if "activitySegment" in entry:
+            segment = entry["activitySegment"]
+            start_point = self.parse_e7_location(segment.get("startLocation"))
+            end_point = self.parse_e7_location(segment.get("endLocation"))
+            try:
+                distance = float(segment.get("distance", 0))
+            except (TypeError, ValueError):
+                distance = 0.0
+            return segment_fingerprint(f"activity:{segment.get('activityType', '')}", None, start, end,
+                                       distance, (start_point or (NAN, NAN)) + (end_point or (NAN, NAN)))
+        if "activities" in entry and entry["activities"]:
+            try:
+                distance = float(entry.get("distance") or 0.0)
+            except (TypeError, ValueError):
+                distance = 0.0
+            return segment_fingerprint("activities", None, start, end, distance)
+        return 0
+
+    def fingerprints(self, entries: List[Dict[str, Any]], starts: Iterable[int],
+                     ends: Iterable[int]) -> List[int]:
+        """``fingerprint`` of a batch of segments (E7 coordinates need no bulk parse)."""
+        return list(map(self.fingerprint, entries, starts, ends))
+
+    def to_store(self, data: Iterable[Dict[str, Any]], memory_budget: Optional[int] = None) -> SegmentStore:
+        """Normalize segments into a ``SegmentStore``, spilling to disk past ``memory_budget`` bytes."""
+        store = SegmentStore(memory_budget=memory_budget)
         for entry in data:
-            if "activitySegment" in entry:
-                waypoints = entry["activitySegment"].get("waypointPath", {}).get("waypoints", [])
-                for waypoint in waypoints:
-                    total_points += 2  # Two checks per point: lat and lng
-                    
-                    if "latE7" in waypoint and "lngE7" in waypoint:
-                        try:
-                            lat = float(waypoint["latE7"]) / 1e7
-                            lng = float(waypoint["lngE7"]) / 1e7
-                            if -90 <= lat <= 90 and -180 <= lng <= 180:
-                                valid_points += 2
-                        except ValueError:
-                            pass
-        
-        return valid_points / total_points if total_points > 0 else 1.0
+            store.append(self.segment_row(entry))
+        return store
 
-    def check_for_regular_intervals(self, data: List[Dict[str, Any]]) -> float:
-        if not data:
-            return 1.0
-            
-        intervals = []
-        for i in range(len(data) - 1):
-            end_cur = self.parse_time(data[i].get("endTime"))
-            start_next = self.parse_time(data[i + 1].get("startTime"))
-            if end_cur and start_next:
-                intervals.append((start_next - end_cur).total_seconds())
+    def segment_rows(self, entries: List[Dict[str, Any]]) -> List[tuple]:
+        """Normalize a batch of segments."""
+        return [self.segment_row(entry) for entry in entries]
+
+    def level_ok(self, level: int, confidence: float) -> bool:
+        """Whether an entry flagged ``LEVEL_CHECKED`` passes the hierarchy level check."""
+        return 0.0 <= confidence <= 1.0
+
+    def tally(self, store: SegmentStore) -> CheckCounts:
+        return count_checks(
+            store,
+            max_speed_m_s=self.max_speed_m_s,
+            max_walk_speed=self.max_walk_speed,
+            max_run_speed=self.max_run_speed,
+            level_ok=self.level_ok,
+            max_gap_m=self.max_continuity_gap_m,
+        )
+
+    def _tally_entries(self, data: Union[List[Dict[str, Any]], SegmentStore]) -> CheckCounts:
+        if isinstance(data, SegmentStore):
+            return self.tally(data)
+        with self.to_store(data) as store:
+            return self.tally(store)
+
+    def check_time_order(self, data: List[Dict[str, Any]]) -> float:
+        return self._tally_entries(data).score('time_order')
 
-        if not intervals:
-            return 1.0
+    def check_suspicious_speed(self, data: List[Dict[str, Any]]) -> float:
+        return self._tally_entries(data).score('speed')
+
+    def check_inconsistent_probabilities(self, data: List[Dict[str, Any]]) -> float:
+        return self._tally_entries(data).score('probabilities')
+
+    def check_hierarchy_levels(self, data: List[Dict[str, Any]]) -> float:
+        return self._tally_entries(data).score('levels')
 
-        c = Counter(intervals)
-        uniqueness_ratio = len(c) / len(intervals)
-        return uniqueness_ratio
+    def check_waypoints(self, data: List[Dict[str, Any]]) -> float:
+        return self._tally_entries(data).score('paths')
+
+    def check_for_regular_intervals(self, data: List[Dict[str, Any]]) -> float:
+        return self._tally_entries(data).score('intervals')
 
     def check_local_travel_vs_mode(self, data: List[Dict[str, Any]]) -> float:
-        if not data:
-            return 1.0
-            
-        valid_modes = 0
-        total_checked = 0
-        
-        for entry in data:
-            if "activitySegment" in entry:
-                activity_type = entry["activitySegment"].get("activityType", "").lower()
-                if not (activity_type and ("walking" in activity_type or "running" in activity_type)):
-                    continue
-                    
-                total_checked += 1
-                start_time = self.parse_time(entry["activitySegment"].get("startTime"))
-                end_time = self.parse_time(entry["activitySegment"].get("endTime"))
-                
-                try:
-                    dist_m = float(entry["activitySegment"].get("distance", 0))
-                except ValueError:
-                    dist_m = 0.0
+        return self._tally_entries(data).score('travel')
 
-                speed = self.calc_speed(dist_m, start_time, end_time)
-                
-                if ("walking" in activity_type and speed <= self.max_walk_speed) or \
-                   ("running" in activity_type and speed <= self.max_run_speed):
-                    valid_modes += 1
-        
-        return valid_modes / total_checked if total_checked > 0 else 1.0
+    def check_spatial_continuity(self, data: List[Dict[str, Any]]) -> float:
+        return self._tally_entries(data).score('continuity')
+
+    def check_duplicate_segments(self, data: List[Dict[str, Any]]) -> float:
+        return self._tally_entries(data).score('duplicates')
 
     def check_time_span(self, data: List[Dict[str, Any]]) -> float:
-        if not data:
-            return 0.0
-        
-        earliest_time = None
-        latest_time = None
-        
-        for entry in data:
-            start = self.parse_time(entry.get("startTime"))
-            end = self.parse_time(entry.get("endTime"))
-            
-            if start:
-                if earliest_time is None or start < earliest_time:
-                    earliest_time = start
-            if end:
-                if latest_time is None or end > latest_time:
-                    latest_time = end
-        
-        if earliest_time and latest_time:
-            return ((latest_time - earliest_time).total_seconds())/86400.0
-        return 0.0
+        return self._tally_entries(data).time_span_days
 
-    def validate(self, data: List[Dict[str, Any]]) -> float:
-        # Android data is already a list of segments
-        segments = data
-        print(f"\nStarting validation with {len(segments)} segments")
-        
-        checks = [
-            ("Time Order", self.check_time_order(segments)),
-            ("Suspicious Speed", self.check_suspicious_speed(segments)),
-            ("Probabilities", self.check_inconsistent_probabilities(segments)),
-            ("Hierarchy Levels", self.check_hierarchy_levels(segments)),
-            ("Waypoints", self.check_waypoints(segments)),
-            ("Regular Intervals", self.check_for_regular_intervals(segments)),
-            ("Local Travel", self.check_local_travel_vs_mode(segments))
+    def check_covered_days(self, data: List[Dict[str, Any]]) -> int:
+        return self._tally_entries(data).covered_days
+
+    def check_results(self, counts: CheckCounts) -> List[Tuple[str, float]]:
+        return [
+            ("Time Order", counts.score('time_order')),
+            ("Suspicious Speed", counts.score('speed')),
+            ("Probabilities", counts.score('probabilities')),
+            ("Hierarchy Levels", counts.score('levels')),
+            ("Waypoints", counts.score('paths')),
+            ("Regular Intervals", counts.score('intervals')),
+            ("Local Travel", counts.score('travel')),
+            ("Spatial Continuity", counts.score('continuity')),
+            ("Duplicate Segments", counts.score('duplicates'))
         ]
+
+    def validate(self, data: Iterable[Dict[str, Any]], memory_budget: Optional[int] = None,
+                 cache_path: Optional[str] = None, approximate: bool = False) -> float:
+        """Score a list of segments in a single pass over their normalized columns.
+
+        ``data`` may be a list or any iterable of segments (e.g. a streaming
+        reader). With ``memory_budget`` set, segments beyond that many bytes
+        spill to a temporary SQLite store. With ``cache_path`` set, the
+        normalized columns are also written there for later re-scoring.
+        With ``approximate`` set, the per-entry ratio checks are estimated
+        from a random sample instead (see ``my_proof.sampling``).
+        """
+        if approximate:
+            return validate_sampled(self, data)
+        # Android data is already a list of segments
+        with self.to_store(data, memory_budget) as store:
+            if store.spilled:
+                print(f"Segments spilled to disk (memory budget {memory_budget} bytes)")
+            if cache_path:
+                write_segment_cache(cache_path, store, self.data_format)
+                print(f"Wrote segment cache: {cache_path}")
+            return self.validate_store(store)
+
+    def validate_store(self, store: SegmentStore) -> float:
+        """Score already normalized segments, e.g. a mapped ``segment_cache`` file."""
+        print(f"\nStarting validation with {len(store)} segments")
+        counts = self.tally(store)
+        checks = self.check_results(counts)
         
         print("\nIndividual check results:")
         for name, value in checks:
@@ -241,17 +307,19 @@ class AndroidLocationHistoryValidator:
             
         valid = sum(value for _, value in checks)
         print(f"\nSum of all checks: {valid:.3f}")
-        print(f"Minimum threshold: {7*0.1}")
+        threshold = len(checks) * 0.1
+        print(f"Minimum threshold: {threshold}")
         
-        if valid < (7*0.1):
+        if valid < threshold:
             print("Failed validation - returning -1")
             return -1
         
-        time_span = self.check_time_span(segments)
+        time_span = counts.time_span_days
         print(f"\nTime span in days: {time_span:.2f}")
-        print(f"Time span score (divided by 60): {time_span/60.0:.3f}")
+        print(f"Days with data: {counts.covered_days}")
+        print(f"Coverage score (divided by 60): {counts.covered_days/60.0:.3f}")
         
-        final_score = min(time_span/60.0, 1.0)
+        final_score = counts.coverage_score
         print(f"Final clamped score: {final_score:.3f}")
         
         return final_score
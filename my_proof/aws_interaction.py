@@ -1,25 +1,137 @@
-import boto3
-import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
 
-def download_json_from_s3(bucket_name, file_key, aws_access_key_id, aws_secret_access_key):
+from my_proof import json_backend
 
-    # Initialize S3 client
-    s3 = boto3.client(
+# Objects larger than one chunk are fetched as concurrent byte ranges
+DEFAULT_CHUNK_BYTES = 8 << 20
+DEFAULT_MAX_CONCURRENCY = 8
+# Downloads restarted from byte 0 when the object is replaced mid-download
+MAX_DOWNLOAD_ATTEMPTS = 3
+
+
+def s3_client(aws_access_key_id, aws_secret_access_key, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+              timeout=None):
+    """Create an S3 client with a connection per concurrent range request.
+
+    With ``timeout`` (seconds), connecting and each socket read are bounded
+    by it and a failed request is retried once, instead of botocore's 60 s
+    timeouts and several retries.
+    """
+    # boto3 is heavy to import, so only load it once S3 is actually used
+    import boto3
+    from botocore.config import Config
+
+    options = {'max_pool_connections': max(10, max_concurrency)}
+    if timeout:
+        options.update(connect_timeout=timeout, read_timeout=timeout,
+                       retries={'mode': 'standard', 'total_max_attempts': 2})
+    return boto3.client(
         's3',
         aws_access_key_id=aws_access_key_id,
-        aws_secret_access_key=aws_secret_access_key
+        aws_secret_access_key=aws_secret_access_key,
+        config=Config(**options)
     )
 
+
+def _read_into(body, view: memoryview) -> None:
+    """Fill ``view`` from a response body, without an intermediate copy where botocore allows it."""
+    readinto = getattr(body, 'readinto', None)
+    filled = 0
+    while filled < len(view):
+        if readinto is not None:
+            count = readinto(view[filled:])
+        else:
+            chunk = body.read(len(view) - filled)
+            count = len(chunk)
+            view[filled:filled + count] = chunk
+        if not count:
+            raise IOError(f"Response body ended after {filled} of {len(view)} bytes")
+        filled += count
+
+
+def _error_code(error) -> Optional[str]:
+    return error.response.get('Error', {}).get('Code')
+
+
+def download_object(s3, bucket_name, file_key, chunk_bytes=DEFAULT_CHUNK_BYTES,
+                    max_concurrency=DEFAULT_MAX_CONCURRENCY, **request) -> Tuple[bytearray, Optional[str]]:
+    """Download an object into one preallocated buffer, fetching byte ranges concurrently.
+
+    The first request asks for the first ``chunk_bytes`` and learns the
+    object size and ETag from the response, so a small object costs a
+    single GET. The rest is fetched in ``chunk_bytes`` ranges on up to
+    ``max_concurrency`` threads, each read straight into its slice of the
+    buffer and pinned to the ETag. An object replaced mid-download fails
+    those ranges (412) instead of mixing two versions, and the download
+    restarts from byte 0, up to ``MAX_DOWNLOAD_ATTEMPTS`` times.
+
+    Extra keyword arguments (e.g. ``IfNoneMatch``) are passed to the first
+    ``get_object`` request; its errors propagate.
+
+    Returns:
+        (object content, ETag)
+    """
+    for attempt in range(MAX_DOWNLOAD_ATTEMPTS):
+        try:
+            return _download_once(s3, bucket_name, file_key, chunk_bytes, max_concurrency, request)
+        except s3.exceptions.ClientError as e:
+            if _error_code(e) != 'PreconditionFailed' or attempt == MAX_DOWNLOAD_ATTEMPTS - 1:
+                raise
+            logging.warning(f"{file_key} changed while downloading, restarting")
+
+
+def _download_once(s3, bucket_name, file_key, chunk_bytes, max_concurrency,
+                   request) -> Tuple[bytearray, Optional[str]]:
     try:
-        # Download the file from S3
-        response = s3.get_object(Bucket=bucket_name, Key=file_key)
-        
-        # Read the content and parse it as JSON
-        content = response['Body'].read().decode('utf-8')
-        json_data = json.loads(content)
-        
+        response = s3.get_object(Bucket=bucket_name, Key=file_key, Range=f"bytes=0-{chunk_bytes - 1}", **request)
+    except s3.exceptions.ClientError as e:
+        if _error_code(e) != 'InvalidRange':
+            raise
+        # An empty object has no byte 0
+        response = s3.get_object(Bucket=bucket_name, Key=file_key, **request)
+    first = response['ContentLength']
+    content_range = response.get('ContentRange')
+    # "bytes 0-<last>/<size>"; without it the server sent the whole object
+    size = int(content_range.rsplit('/', 1)[1]) if content_range else first
+    etag = response.get('ETag')
+
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    ranges = [(begin, min(begin + chunk_bytes, size)) for begin in range(first, size, chunk_bytes)]
+
+    def fetch(begin, end):
+        pinned = {'IfMatch': etag} if etag else {}
+        part = s3.get_object(Bucket=bucket_name, Key=file_key, Range=f"bytes={begin}-{end - 1}", **pinned)
+        _read_into(part['Body'], view[begin:end])
+
+    if not ranges:
+        _read_into(response['Body'], view)
+        return buffer, etag
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(ranges)),
+                            thread_name_prefix='s3-range') as pool:
+        futures = [pool.submit(fetch, begin, end) for begin, end in ranges]
+        # The first range is read while the others are in flight
+        _read_into(response['Body'], view[:first])
+        for future in futures:
+            future.result()
+    return buffer, etag
+
+
+def download_json_from_s3(bucket_name, file_key, aws_access_key_id, aws_secret_access_key,
+                          chunk_bytes=DEFAULT_CHUNK_BYTES, max_concurrency=DEFAULT_MAX_CONCURRENCY, timeout=None):
+    # Initialize S3 client
+    s3 = s3_client(aws_access_key_id, aws_secret_access_key, max_concurrency, timeout)
+
+    try:
+        # Download the file from S3 in concurrent byte ranges
+        content, _ = download_object(s3, bucket_name, file_key, chunk_bytes, max_concurrency)
+
+        # Parse the downloaded buffer as JSON
+        json_data = json_backend.loads(content)
+
         return json_data
     except Exception as e:
         print(f"Error downloading or parsing JSON from S3: {str(e)}")
         return None
-
@@ -1,22 +1,47 @@
 import json
 import math
 from datetime import datetime
-from typing import List, Dict, Any, Optional, Union
-from collections import Counter
-from dateutil import parser
+from itertools import islice
+from typing import Iterable, Iterator, List, Dict, Any, Optional, Tuple, Union
+
+from my_proof.segments import (
+    GEO_ACTIVITY, GEO_VISIT, LEVEL_CHECKED, MISSING, NAN, RUN, SPEED_CHECKED, WALK, CheckCounts,
+    SegmentStore, count_checks, segment_fingerprint, segment_row, speed_between, to_micros,
+)
+from my_proof.geo import parse_geo_string, parse_geo_strings
+from my_proof.sampling import validate_sampled
+from my_proof.segment_cache import write_segment_cache
 
 class LocationHistoryValidator:
+    data_format = 'ios'
+    # Members of the export the checks read, as a streaming.Projection. The
+    # export is the entry array itself; entries are decoded whole, which in C
+    # is cheaper than projecting away their few unused members in Python
+    projection = True
+    # Entry members whose segments are visits or activities (GEO flags)
+    geo_keys = ("activity", "visit")
+    # Entries normalized per to_store batch, i.e. per bulk coordinate parse
+    batch_size = 4096
+
     def __init__(self, max_speed_m_s: float = 44.44, allowed_hierarchy_levels: List[int] = [0, 1, 2]):
         self.max_speed_m_s = max_speed_m_s
         self.allowed_hierarchy_levels = allowed_hierarchy_levels
         self.max_walk_speed = 1.4
         self.max_run_speed = 3.5
+        self.max_continuity_gap_m = 1000.0
         
     @staticmethod
     def parse_time(time_str: str) -> Optional[datetime]:
         if not time_str:
             return None
         try:
+            # Fast path: exports use ISO 8601, which the stdlib parses natively
+            return datetime.fromisoformat(time_str)
+        except (TypeError, ValueError):
+            pass
+        try:
+            # dateutil is only imported for the odd non-ISO timestamp
+            from dateutil import parser
             return parser.parse(time_str)
         except Exception:
             return None
@@ -42,221 +67,291 @@ class LocationHistoryValidator:
 
     @staticmethod
     def parse_geo_string(geo_str: str) -> Optional[tuple]:
-        if not geo_str:
-            return None
-        try:
-            if "geo:" in geo_str:
-                # iOS format
-                coords = geo_str.split("geo:")[1]
-            else:
-                # Android format
-                coords = geo_str.replace("°", "")
-            lat_str, lon_str = coords.split(",")
-            return float(lat_str), float(lon_str)
-        except Exception:
-            return None
+        return parse_geo_string(geo_str)
 
-    def check_time_order(self, data: List[Dict[str, Any]]) -> float:
-        if not data:
-            return 1.0
-            
-        issues = 0
-        total_checks = len(data) * 2 - 1  # Two checks per entry plus transitions
-        
-        for i, entry in enumerate(data):
-            start = self.parse_time(entry.get("startTime"))
-            end = self.parse_time(entry.get("endTime"))
-            if start and end and end < start:
-                issues += 1
-            if i < len(data) - 1:
-                next_start = self.parse_time(data[i + 1].get("startTime"))
-                if end and next_start and next_start < end:
-                    issues += 1
-        
-        return 1.0 - (issues / total_checks)
+    @staticmethod
+    def geo_strings(entry: Dict[str, Any]) -> List[Any]:
+        """Coordinate strings of an entry, in the order ``segment_row`` consumes them."""
+        strings = []
+        if "activity" in entry:
+            strings.append(entry["activity"].get("start"))
+            strings.append(entry["activity"].get("end"))
+        if "visit" in entry:
+            strings.append(entry["visit"].get("topCandidate", {}).get("placeLocation"))
+        if "timelinePath" in entry and isinstance(entry["timelinePath"], list):
+            strings.extend(path_node.get("point", "") for path_node in entry["timelinePath"])
+        return strings
 
-    def check_suspicious_speed(self, data: List[Dict[str, Any]]) -> float:
-        if not data:
-            return 1.0
-            
-        valid_entries = 0
-        total_checked = 0
-        
-        for entry in data:
-            if "activity" in entry:
-                total_checked += 1
-                activity = entry["activity"]
-                distance_str = activity.get("distanceMeters")
-                start_time = self.parse_time(entry.get("startTime"))
-                end_time = self.parse_time(entry.get("endTime"))
+    def segment_row(self, entry: Dict[str, Any],
+                    points: Optional[Iterator[Tuple[float, float, int]]] = None) -> tuple:
+        """Normalize one entry into a ``segments.COLUMNS`` row.
+
+        ``points`` yields (lat, lng, valid) for the entry's ``geo_strings``,
+        e.g. from a batch parsed by ``segment_rows``; by default they are
+        parsed here.
+        """
+        if points is None:
+            points = zip(*parse_geo_strings(self.geo_strings(entry)))
+        start = to_micros(self.parse_time(entry.get("startTime")))
+        end = to_micros(self.parse_time(entry.get("endTime")))
+        flags = 0
+        distance = NAN
+        speed = travel_speed = 0.0
+        prob_valid = prob_total = 0
+        level = MISSING
+        path_valid = path_total = 0
+        start_lat = start_lng = end_lat = end_lng = NAN
+        identity = None
+
+        if "activity" in entry:
+            flags |= SPEED_CHECKED | GEO_ACTIVITY
+            activity = entry["activity"]
+            start_point = next(points)
+            end_point = next(points)
+            if start_point[2] and end_point[2]:
+                start_lat, start_lng, _ = start_point
+                end_lat, end_lng, _ = end_point
+            identity = (start_lat, start_lng, end_lat, end_lng)
+            distance_str = activity.get("distanceMeters")
+            try:
+                dist_m = float(distance_str) if distance_str else 0.0
+            except ValueError:
+                dist_m = 0.0
+            distance = dist_m
+            speed = speed_between(dist_m, start, end)
+
+            if "topCandidate" in activity:
+                mode = activity["topCandidate"].get("type", "").lower()
+                if "walk" in mode:
+                    flags |= WALK
+                if "run" in mode:
+                    flags |= RUN
+                travel_speed = speed
+
+        for key in ["activity", "visit"]:
+            if key in entry:
+                # Check main probability
+                if "probability" in entry[key]:
+                    prob_total += 1
+                    try:
+                        prob = float(entry[key]["probability"])
+                        if 0.0 <= prob <= 1.0:
+                            prob_valid += 1
+                    except ValueError:
+                        pass
+
+                # Check topCandidate probability
+                if "topCandidate" in entry[key] and "probability" in entry[key]["topCandidate"]:
+                    prob_total += 1
+                    try:
+                        prob = float(entry[key]["topCandidate"]["probability"])
+                        if 0.0 <= prob <= 1.0:
+                            prob_valid += 1
+                    except ValueError:
+                        pass
+
+        if "visit" in entry:
+            flags |= GEO_VISIT
+            place_lat, place_lng, place_valid = next(points)
+            identity = (place_lat, place_lng) * 2
+            if place_valid:
+                start_lat, start_lng = end_lat, end_lng = place_lat, place_lng
+
+        if "visit" in entry and "hierarchyLevel" in entry["visit"]:
+            flags |= LEVEL_CHECKED
+            try:
+                level = int(entry["visit"]["hierarchyLevel"])
+            except ValueError:
+                pass
+
+        if "timelinePath" in entry and isinstance(entry["timelinePath"], list):
+            for path_node in entry["timelinePath"]:
+                path_total += 2  # Two checks per point
+
+                if next(points)[2]:
+                    path_valid += 1
 
                 try:
-                    dist_m = float(distance_str) if distance_str else 0.0
-                except ValueError:
-                    dist_m = 0.0
+                    float(path_node.get("durationMinutesOffsetFromStartTime"))
+                    path_valid += 1
+                except (TypeError, ValueError):
+                    pass
 
-                speed = self.calc_speed(dist_m, start_time, end_time)
-                if speed <= self.max_speed_m_s:
-                    valid_entries += 1
-        
-        return valid_entries / total_checked if total_checked > 0 else 1.0
+        fingerprint = self.fingerprint(entry, start, end, identity)
+        return segment_row(start=start, end=end, flags=flags, distance=distance, speed=speed,
+                           travel_speed=travel_speed, prob_valid=prob_valid,
+                           prob_total=prob_total, level=level,
+                           path_valid=path_valid, path_total=path_total,
+                           start_lat=start_lat, start_lng=start_lng, end_lat=end_lat, end_lng=end_lng,
+                           fingerprint=fingerprint)
+
+    def fingerprint(self, entry: Dict[str, Any], start: int, end: int,
+                    coords: Optional[Tuple[float, float, float, float]] = None) -> int:
+        """Identity hash of an entry's visit or activity (0 for neither) for the duplicate check.
+
+        ``coords`` are the already parsed (start_lat, start_lng, end_lat,
+        end_lng) of the visit's place or else the activity, NaN where
+        unparsable; by default they are parsed here.
+        """
+        if "visit" in entry:
+            top_candidate = entry["visit"].get("topCandidate", {})
+            place = top_candidate.get("placeID")
+            if place is not None:
+                return segment_fingerprint("visit", place, start, end)
+            if coords is None:
+                coords = (self.parse_geo_string(top_candidate.get("placeLocation")) or (NAN, NAN)) * 2
+            return segment_fingerprint("visit", None, start, end, coords=coords[:2])
+        if "activity" in entry:
+            activity = entry["activity"]
+            if coords is None:
+                start_point = self.parse_geo_string(activity.get("start"))
+                end_point = self.parse_geo_string(activity.get("end"))
+                coords = start_point + end_point if start_point and end_point else (NAN,) * 4
+            try:
+                distance = float(activity.get("distanceMeters") or 0.0)
+            except ValueError:
+                distance = 0.0
+            mode = activity.get("topCandidate", {}).get("type", "")
+            return segment_fingerprint(f"activity:{mode}", None, start, end, distance, coords)
+        return 0
+
+    def fingerprints(self, entries: List[Dict[str, Any]], starts: Iterable[int],
+                     ends: Iterable[int]) -> List[int]:
+        """``fingerprint`` of a batch of entries, parsing their coordinates in one pass."""
+        strings = []
+        for entry in entries:
+            if "visit" in entry:
+                strings.append(entry["visit"].get("topCandidate", {}).get("placeLocation"))
+            elif "activity" in entry:
+                strings.append(entry["activity"].get("start"))
+                strings.append(entry["activity"].get("end"))
+        lats, lngs, valid = parse_geo_strings(strings)
+        fingerprints = []
+        i = 0
+        for entry, start, end in zip(entries, starts, ends):
+            coords = None
+            if "visit" in entry:
+                coords = (lats[i], lngs[i]) * 2
+                i += 1
+            elif "activity" in entry:
+                if valid[i] and valid[i + 1]:
+                    coords = (lats[i], lngs[i], lats[i + 1], lngs[i + 1])
+                else:
+                    coords = (NAN,) * 4
+                i += 2
+            fingerprints.append(self.fingerprint(entry, start, end, coords))
+        return fingerprints
+
+    def to_store(self, data: Iterable[Dict[str, Any]], memory_budget: Optional[int] = None) -> SegmentStore:
+        """Normalize entries into a ``SegmentStore``, spilling to disk past ``memory_budget`` bytes."""
+        store = SegmentStore(memory_budget=memory_budget)
+        entries = iter(data)
+        while True:
+            batch = list(islice(entries, self.batch_size))
+            if not batch:
+                return store
+            store.extend(self.segment_rows(batch))
+
+    def segment_rows(self, entries: List[Dict[str, Any]]) -> List[tuple]:
+        """Normalize a batch of entries, parsing all their coordinates in one pass."""
+        strings = []
+        for entry in entries:
+            strings.extend(self.geo_strings(entry))
+        points = zip(*parse_geo_strings(strings))
+        return [self.segment_row(entry, points) for entry in entries]
+
+    def level_ok(self, level: int, confidence: float) -> bool:
+        """Whether an entry flagged ``LEVEL_CHECKED`` passes the hierarchy level check."""
+        return level in self.allowed_hierarchy_levels
+
+    def tally(self, store: SegmentStore) -> CheckCounts:
+        return count_checks(
+            store,
+            max_speed_m_s=self.max_speed_m_s,
+            max_walk_speed=self.max_walk_speed,
+            max_run_speed=self.max_run_speed,
+            level_ok=self.level_ok,
+            max_gap_m=self.max_continuity_gap_m,
+        )
+
+    def _tally_entries(self, data: Union[List[Dict[str, Any]], SegmentStore]) -> CheckCounts:
+        if isinstance(data, SegmentStore):
+            return self.tally(data)
+        with self.to_store(data) as store:
+            return self.tally(store)
+
+    def check_time_order(self, data: List[Dict[str, Any]]) -> float:
+        return self._tally_entries(data).score('time_order')
+
+    def check_suspicious_speed(self, data: List[Dict[str, Any]]) -> float:
+        return self._tally_entries(data).score('speed')
 
     def check_inconsistent_probabilities(self, data: List[Dict[str, Any]]) -> float:
-        if not data:
-            return 1.0
-            
-        valid_probs = 0
-        total_probs = 0
-        
-        for entry in data:
-            for key in ["activity", "visit"]:
-                if key in entry:
-                    # Check main probability
-                    if "probability" in entry[key]:
-                        total_probs += 1
-                        try:
-                            prob = float(entry[key]["probability"])
-                            if 0.0 <= prob <= 1.0:
-                                valid_probs += 1
-                        except ValueError:
-                            pass
-                            
-                    # Check topCandidate probability
-                    if "topCandidate" in entry[key] and "probability" in entry[key]["topCandidate"]:
-                        total_probs += 1
-                        try:
-                            prob = float(entry[key]["topCandidate"]["probability"])
-                            if 0.0 <= prob <= 1.0:
-                                valid_probs += 1
-                        except ValueError:
-                            pass
-        
-        return valid_probs / total_probs if total_probs > 0 else 1.0
+        return self._tally_entries(data).score('probabilities')
 
     def check_hierarchy_levels(self, data: List[Dict[str, Any]]) -> float:
-        if not data:
-            return 1.0
-        valid_levels = 0
-        total_checked = 0
-        
-        for entry in data:
-            if "visit" in entry and "hierarchyLevel" in entry["visit"]:
-                total_checked += 1
-                try:
-                    hl = int(entry["visit"]["hierarchyLevel"])
-                    if hl in self.allowed_hierarchy_levels:
-                        valid_levels += 1
-                except ValueError:
-                    pass
-        
-        return valid_levels / total_checked if total_checked > 0 else 1.0
+        return self._tally_entries(data).score('levels')
 
     def check_timeline_paths(self, data: List[Dict[str, Any]]) -> float:
-        if not data:
-            return 1.0
-            
-        valid_points = 0
-        total_points = 0
-        
-        for entry in data:
-            if "timelinePath" in entry and isinstance(entry["timelinePath"], list):
-                for path_node in entry["timelinePath"]:
-                    total_points += 2  # Two checks per point
-                    
-                    if self.parse_geo_string(path_node.get("point", "")):
-                        valid_points += 1
-                        
-                    try:
-                        float(path_node.get("durationMinutesOffsetFromStartTime"))
-                        valid_points += 1
-                    except (TypeError, ValueError):
-                        pass
-        
-        return valid_points / total_points if total_points > 0 else 1.0
+        return self._tally_entries(data).score('paths')
 
     def check_for_regular_intervals(self, data: List[Dict[str, Any]]) -> float:
-        if not data:
-            return 1.0
-            
-        intervals = []
-        for i in range(len(data) - 1):
-            end_cur = self.parse_time(data[i].get("endTime"))
-            start_next = self.parse_time(data[i + 1].get("startTime"))
-            if end_cur and start_next:
-                intervals.append((start_next - end_cur).total_seconds())
+        return self._tally_entries(data).score('intervals')
 
-        if not intervals:
-            return 1.0
+    def check_local_travel_vs_mode(self, data: List[Dict[str, Any]]) -> float:
+        return self._tally_entries(data).score('travel')
 
-        c = Counter(intervals)
-        uniqueness_ratio = len(c) / len(intervals)
-        return uniqueness_ratio
+    def check_spatial_continuity(self, data: List[Dict[str, Any]]) -> float:
+        return self._tally_entries(data).score('continuity')
 
-    def check_local_travel_vs_mode(self, data: List[Dict[str, Any]]) -> float:
-        if not data:
-            return 1.0
-            
-        valid_modes = 0
-        total_checked = 0
-        
-        for entry in data:
-            if "activity" in entry and "topCandidate" in entry["activity"]:
-                mode = entry["activity"]["topCandidate"].get("type", "").lower()
-                if not (mode and ("walk" in mode or "run" in mode)):
-                    continue
-                    
-                total_checked += 1
-                start_time = self.parse_time(entry.get("startTime"))
-                end_time = self.parse_time(entry.get("endTime"))
-                
-                try:
-                    dist_m = float(entry["activity"].get("distanceMeters", 0))
-                except ValueError:
-                    dist_m = 0.0
-
-                speed = self.calc_speed(dist_m, start_time, end_time)
-                
-                if ("walk" in mode and speed <= self.max_walk_speed) or \
-                   ("run" in mode and speed <= self.max_run_speed):
-                    valid_modes += 1
-        
-        return valid_modes / total_checked if total_checked > 0 else 1.0
+    def check_duplicate_segments(self, data: List[Dict[str, Any]]) -> float:
+        return self._tally_entries(data).score('duplicates')
 
     def check_time_span(self, data: List[Dict[str, Any]]) -> float:
-        if not data:
-            return 0.0
-        
-        # Initialize with None to handle first valid times found
-        earliest_time = None
-        latest_time = None
-        
-        for entry in data:
-            start = self.parse_time(entry.get("startTime"))
-            end = self.parse_time(entry.get("endTime"))
-            
-            if start:
-                if earliest_time is None or start < earliest_time:
-                    earliest_time = start
-            if end:
-                if latest_time is None or end > latest_time:
-                    latest_time = end
-        
-        if earliest_time and latest_time:
-            return ((latest_time - earliest_time).total_seconds())/86400.0
-        return 0.0
+        return self._tally_entries(data).time_span_days
 
-    def validate(self, data: List[Dict[str, Any]]) -> float:
-        print(f"\nStarting validation with {len(data)} entries")
-        
-        checks = [
-            ("Time Order", self.check_time_order(data)),
-            ("Suspicious Speed", self.check_suspicious_speed(data)),
-            ("Probabilities", self.check_inconsistent_probabilities(data)),
-            ("Hierarchy Levels", self.check_hierarchy_levels(data)),
-            ("Timeline Paths", self.check_timeline_paths(data)),
-            ("Regular Intervals", self.check_for_regular_intervals(data)),
-            ("Local Travel", self.check_local_travel_vs_mode(data))
+    def check_covered_days(self, data: List[Dict[str, Any]]) -> int:
+        return self._tally_entries(data).covered_days
+
+    def check_results(self, counts: CheckCounts) -> List[Tuple[str, float]]:
+        return [
+            ("Time Order", counts.score('time_order')),
+            ("Suspicious Speed", counts.score('speed')),
+            ("Probabilities", counts.score('probabilities')),
+            ("Hierarchy Levels", counts.score('levels')),
+            ("Timeline Paths", counts.score('paths')),
+            ("Regular Intervals", counts.score('intervals')),
+            ("Local Travel", counts.score('travel')),
+            ("Spatial Continuity", counts.score('continuity')),
+            ("Duplicate Segments", counts.score('duplicates'))
         ]
+
+    def validate(self, data: Iterable[Dict[str, Any]], memory_budget: Optional[int] = None,
+                 cache_path: Optional[str] = None, approximate: bool = False) -> float:
+        """Score a history in a single pass over its normalized segments.
+
+        ``data`` may be a list or any iterable of entries (e.g. a streaming
+        reader). With ``memory_budget`` set, segments beyond that many bytes
+        spill to a temporary SQLite store. With ``cache_path`` set, the
+        normalized columns are also written there for later re-scoring.
+        With ``approximate`` set, the per-entry ratio checks are estimated
+        from a random sample instead (see ``my_proof.sampling``).
+        """
+        if approximate:
+            return validate_sampled(self, data)
+        with self.to_store(data, memory_budget) as store:
+            if store.spilled:
+                print(f"Segments spilled to disk (memory budget {memory_budget} bytes)")
+            if cache_path:
+                write_segment_cache(cache_path, store, self.data_format)
+                print(f"Wrote segment cache: {cache_path}")
+            return self.validate_store(store)
+
+    def validate_store(self, store: SegmentStore) -> float:
+        """Score already normalized segments, e.g. a mapped ``segment_cache`` file."""
+        print(f"\nStarting validation with {len(store)} entries")
+        counts = self.tally(store)
+        checks = self.check_results(counts)
         
         print("\nIndividual check results:")
         for name, value in checks:
@@ -264,17 +359,19 @@ class LocationHistoryValidator:
             
         valid = sum(value for _, value in checks)
         print(f"\nSum of all checks: {valid:.3f}")
-        print(f"Minimum threshold: {7*0.1}")
+        threshold = len(checks) * 0.1
+        print(f"Minimum threshold: {threshold}")
         
-        if valid < (7*0.1):
+        if valid < threshold:
             print("Failed validation - returning -1")
             return -1
         
-        time_span = self.check_time_span(data)
+        time_span = counts.time_span_days
         print(f"\nTime span in days: {time_span:.2f}")
-        print(f"Time span score (divided by 60): {time_span/60.0:.3f}")
+        print(f"Days with data: {counts.covered_days}")
+        print(f"Coverage score (divided by 60): {counts.covered_days/60.0:.3f}")
         
-        final_score = min(time_span/60.0, 1.0)
+        final_score = counts.coverage_score
         print(f"Final clamped score: {final_score:.3f}")
         
         return final_score
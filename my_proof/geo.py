@@ -0,0 +1,94 @@
+"""Coordinate string parsing for location history exports.
+
+iOS exports encode every coordinate as a string: activity ``start``/``end``,
+a visit's ``placeLocation`` and each ``timelinePath`` ``point`` look like
+``"geo:51.507351,-0.127758"`` (the Android ``"51.5°, -0.1°"`` form is also
+accepted). ``parse_geo_strings`` parses a whole batch of them with a few
+C-level string passes over the joined strings instead of a split and two
+``float`` calls per point; only strings outside the common ``geo:`` form fall
+back to ``parse_geo_string``, so both always agree.
+"""
+import json
+import re
+from array import array
+from typing import Any, Optional, Sequence, Tuple
+
+# The newline before a line the fast path cannot take, i.e. anything but
+# "geo:<number>,<number>" (the joined text is scanned with a leading newline)
+_IRREGULAR_LINE = re.compile(r'\n(?!geo:[-+0-9.eE]+,[-+0-9.eE]+(?:\n|$))')
+_INVALID = 'geo:NaN,NaN'
+NAN = float('nan')
+
+
+def parse_geo_string(geo_str: str) -> Optional[tuple]:
+    """Parse one coordinate string into (lat, lng), or None if it is malformed."""
+    if not geo_str:
+        return None
+    try:
+        if "geo:" in geo_str:
+            # iOS format
+            coords = geo_str.split("geo:")[1]
+        else:
+            # Android format
+            coords = geo_str.replace("°", "")
+        lat_str, lon_str = coords.split(",")
+        return float(lat_str), float(lon_str)
+    except Exception:
+        return None
+
+
+def parse_geo_strings(values: Sequence[Any]) -> Tuple[array, array, bytearray]:
+    """Parse a batch of coordinate strings.
+
+    Returns:
+        (latitudes, longitudes, valid): two float64 arrays aligned with
+        ``values`` (NaN where unparsable) and a mask holding 1 where
+        ``parse_geo_string`` would have returned a point.
+    """
+    count = len(values)
+    valid = bytearray(b'\x01') * count
+    if not count:
+        return array('d'), array('d'), valid
+    # Newlines would break the one-line-per-value layout; such values and
+    # non-strings are irregular lines like any other malformed value
+    texts = [v if isinstance(v, str) and '\n' not in v else '' for v in values]
+    joined = '\n'.join(texts)
+
+    # Rewrite the (rare) irregular lines into the regular form
+    scanned = '\n' + joined
+    line = last = 0
+    rewritten = False
+    for match in _IRREGULAR_LINE.finditer(scanned):
+        line += scanned.count('\n', last, match.start())
+        last = match.start()
+        point = parse_geo_string(values[line]) if isinstance(values[line], str) else None
+        if point is None:
+            texts[line] = _INVALID
+            valid[line] = 0
+        else:
+            texts[line] = f"geo:{json.dumps(point[0])},{json.dumps(point[1])}"
+        rewritten = True
+    if rewritten:
+        joined = '\n'.join(texts)
+
+    # Every line is now "geo:<lat>,<lng>": strip the prefixes and let the C
+    # JSON scanner convert all numbers as one array
+    numbers = joined.replace('geo:', '').replace('\n', ',')
+    try:
+        coords = array('d', json.loads(f'[{numbers}]'))
+    except (ValueError, OverflowError):
+        # OverflowError: an integer too large for a float, which float() reads as inf
+        try:
+            # Numbers outside JSON syntax that float() still accepts (e.g. "01")
+            coords = array('d', map(float, numbers.split(',')))
+        except (ValueError, OverflowError):
+            # Shaped like numbers but not (e.g. "1-2"): parse value by value
+            return _parse_each(values)
+    return coords[0::2], coords[1::2], valid
+
+
+def _parse_each(values: Sequence[Any]) -> Tuple[array, array, bytearray]:
+    points = [parse_geo_string(v) if isinstance(v, str) else None for v in values]
+    lats = array('d', (point[0] if point else NAN for point in points))
+    lngs = array('d', (point[1] if point else NAN for point in points))
+    return lats, lngs, bytearray(point is not None for point in points)
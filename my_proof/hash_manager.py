@@ -1,87 +1,443 @@
-import boto3
 import json
 from datetime import datetime
 import logging
 import hashlib
+import os
+import posixpath
+import time
+from urllib.parse import quote
+
+from my_proof import json_backend
+from my_proof.aws_interaction import DEFAULT_CHUNK_BYTES, DEFAULT_MAX_CONCURRENCY, download_object, s3_client
+
+SINGLE_LAYOUT = 'single'
+SHARDED_LAYOUT = 'sharded'
 
 class HashManager:
-    def __init__(self, bucket_name, remote_file_key, aws_access_key_id, aws_secret_access_key):
+    """Remote store of contribution hashes in S3
+
+    The ``single`` layout keeps every hash in one JSON object at
+    ``remote_file_key``. The ``sharded`` layout partitions hashes by their
+    first ``shard_prefix_len`` hex digits into one object per prefix under
+    ``<remote_file_key without extension>.shards/``, next to a
+    ``manifest.json`` recording the current prefix length, so a lookup or
+    insert only moves a single shard. See ``migrate_to_sharded`` and
+    ``reshard``.
+
+    Every object read goes through a read-through cache kept in memory (and,
+    with ``cache_dir``, on disk across runs). Entries older than
+    ``cache_ttl`` seconds are revalidated with a conditional GET on the
+    object's ETag, so an unchanged store costs one round trip and no payload.
+    On disk, the age counts from the file's modification time, which such a
+    revalidation refreshes without rewriting the file.
+    Objects larger than ``download_chunk_bytes`` are downloaded as up to
+    ``download_concurrency`` concurrent byte ranges. ``timeout`` bounds
+    each S3 connection and socket read (see ``aws_interaction.s3_client``).
+    """
+
+    def __init__(self, bucket_name, remote_file_key, aws_access_key_id, aws_secret_access_key,
+                 layout=SINGLE_LAYOUT, shard_prefix_len=2, cache_dir=None, cache_ttl=0.0,
+                 download_chunk_bytes=DEFAULT_CHUNK_BYTES, download_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 timeout=None):
         # Initialize S3 client with credentials
-        self.s3_client = boto3.client(
-            's3',
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key
-        )
+        self.s3_client = s3_client(aws_access_key_id, aws_secret_access_key, download_concurrency, timeout)
+        self.download_chunk_bytes = download_chunk_bytes
+        self.download_concurrency = download_concurrency
         self.bucket_name = bucket_name
         self.remote_file_key = remote_file_key
+        if layout not in (SINGLE_LAYOUT, SHARDED_LAYOUT):
+            raise ValueError(f"Unknown hash store layout: {layout}")
+        self.layout = layout
+        self.shard_prefix_len = shard_prefix_len
+        self.shard_root = posixpath.splitext(remote_file_key)[0] + '.shards'
+        self.manifest_key = f"{self.shard_root}/manifest.json"
+        self._manifest = None
+        self.cache_dir = cache_dir
+        self.cache_ttl = cache_ttl
+        self._cache = {}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
 
     def _initialize_empty_hash_file(self):
         """Initialize an empty hash file in S3"""
-        data = {
-            'hashes': [],
-            'lastUpdated': datetime.utcnow().isoformat() + 'Z'
-        }
-        self.s3_client.put_object(
-            Bucket=self.bucket_name,
-            Key=self.remote_file_key,
-            Body=json.dumps(data, indent=2),
-            ContentType='application/json'
-        )
+        self._write_hash_object(self.remote_file_key, [])
         return []
 
-    def get_remote_hashes(self):
-        """Fetch hashes from remote S3 JSON file"""
+    def get_remote_hashes(self, revalidate=False, strict=False):
+        """Fetch hashes from remote S3 JSON file
+
+        Args:
+            revalidate (bool): Check the cached copy against S3 even if it is
+                younger than ``cache_ttl``
+            strict (bool): Raise read errors instead of logging them and
+                returning an empty list
+        """
         try:
-            response = self.s3_client.get_object(
-                Bucket=self.bucket_name,
-                Key=self.remote_file_key
-            )
-            data = json.loads(response['Body'].read().decode('utf-8'))
-            return data.get('hashes', [])
-        except self.s3_client.exceptions.NoSuchKey:
-            # If file doesn't exist, create it and return empty list
-            return self._initialize_empty_hash_file()
+            if self.layout == SHARDED_LAYOUT:
+                return self._get_all_shard_hashes()
+            hashes = self._read_hash_object(self.remote_file_key, revalidate=revalidate)
+            if hashes is None:
+                # If file doesn't exist, create it and return empty list
+                return self._initialize_empty_hash_file()
+            return hashes
         except Exception as e:
+            if strict:
+                raise
             logging.error(f"Error fetching remote hashes: {str(e)}")
             return []
 
     def update_remote_hashes(self, new_hashes):
         """Update remote JSON file with new hashes"""
+        if self.layout == SHARDED_LAYOUT:
+            return self._replace_all_shards(new_hashes)
         try:
-            data = {
-                'hashes': new_hashes,
-                'lastUpdated': datetime.utcnow().isoformat() + 'Z'
-            }
-            
-            self.s3_client.put_object(
-                Bucket=self.bucket_name,
-                Key=self.remote_file_key,
-                Body=json.dumps(data, indent=2),
-                ContentType='application/json'
-            )
+            self._write_hash_object(self.remote_file_key, new_hashes)
             return True
         except Exception as e:
             logging.error(f"Error updating remote hashes: {str(e)}")
             
 
+    def contains_hash(self, hash_to_check, strict=False, revalidate=False):
+        """Check whether a hash is in the store, reading only its shard when sharded
+
+        Read errors are logged and answered with False, or raised with
+        ``strict``. ``revalidate`` is as for ``get_remote_hashes``.
+        """
+        try:
+            if self.layout == SHARDED_LAYOUT:
+                return self._shard_contains(hash_to_check, revalidate=revalidate)
+            entry = self._fetch_entry(self.remote_file_key, revalidate=revalidate)
+            return entry is not None and hash_to_check in entry['set']
+        except Exception as e:
+            if strict:
+                raise
+            logging.error(f"Error fetching remote hashes: {str(e)}")
+            return False
+
     def add_hash(self, new_hash):
-        """Add a single hash to the remote file"""
-        current_hashes = self.get_remote_hashes()
-        if new_hash not in current_hashes:
-            current_hashes.append(new_hash)
-            self.update_remote_hashes(current_hashes)
-            return True
-        return False
+        """Add a single hash to the remote file
+
+        Returns:
+            True once added, False if the store already held it, or None if
+            the store could not be read or written
+        """
+        if self.layout == SHARDED_LAYOUT:
+            return self._add_shard_hash(new_hash)
+        current_hashes = self._read_for_update()
+        if current_hashes is None:
+            return None
+        if new_hash in current_hashes:
+            return False
+        current_hashes.append(new_hash)
+        return self.update_remote_hashes(current_hashes)
 
     def remove_hash(self, hash_to_remove):
-        """Remove a hash from the remote file"""
-        current_hashes = self.get_remote_hashes()
-        if hash_to_remove in current_hashes:
-            current_hashes.remove(hash_to_remove)
-            self.update_remote_hashes(current_hashes)
+        """Remove a hash from the remote file
+
+        Returns:
+            True once removed, False if the store did not hold it, or None if
+            the store could not be read or written
+        """
+        if self.layout == SHARDED_LAYOUT:
+            return self._remove_shard_hash(hash_to_remove)
+        current_hashes = self._read_for_update()
+        if current_hashes is None:
+            return None
+        if hash_to_remove not in current_hashes:
+            return False
+        current_hashes.remove(hash_to_remove)
+        return self.update_remote_hashes(current_hashes)
+
+    def _read_for_update(self):
+        """Read the single-file store before a write, or None if it could not be read
+
+        Writers always revalidate so they never extend a stale copy. Only a
+        missing object counts as an empty store: writing after a failed read
+        would replace every stored hash.
+        """
+        try:
+            hashes = self._read_hash_object(self.remote_file_key, revalidate=True)
+        except Exception as e:
+            logging.error(f"Error fetching remote hashes, store left unchanged: {str(e)}")
+            return None
+        return [] if hashes is None else hashes
+
+    # --- Read-through cache ---------------------------------------------
+
+    def _cache_path(self, key):
+        return os.path.join(self.cache_dir, quote(f"{self.bucket_name}/{key}", safe='') + '.json')
+
+    def _remember_entry(self, key, etag, hashes, checked_at):
+        entry = {'etag': etag, 'hashes': hashes, 'set': set(hashes), 'checked_at': checked_at}
+        self._cache[key] = entry
+        return entry
+
+    def _store_entry(self, key, etag, hashes):
+        entry = self._remember_entry(key, etag, hashes, time.time())
+        if self.cache_dir:
+            # The file's modification time records when it was last checked
+            path = self._cache_path(key)
+            try:
+                with open(f"{path}.tmp", 'wb') as f:
+                    f.write(json_backend.dumps({'etag': etag, 'hashes': hashes}))
+                os.replace(f"{path}.tmp", path)
+            except OSError as e:
+                logging.error(f"Error writing hash cache {path}: {str(e)}")
+        return entry
+
+    def _mark_checked(self, key, entry):
+        """Record that the cached copy of key was found current, without rewriting it"""
+        entry['checked_at'] = time.time()
+        if self.cache_dir:
+            try:
+                os.utime(self._cache_path(key), (entry['checked_at'], entry['checked_at']))
+            except OSError as e:
+                logging.error(f"Error updating hash cache {self._cache_path(key)}: {str(e)}")
+
+    def _drop_entry(self, key):
+        self._cache.pop(key, None)
+        if self.cache_dir:
+            try:
+                os.remove(self._cache_path(key))
+            except OSError:
+                pass
+
+    def _cached_entry(self, key):
+        entry = self._cache.get(key)
+        if entry is None and self.cache_dir:
+            path = self._cache_path(key)
+            try:
+                # Stat first: a copy replaced meanwhile then only looks older
+                checked_at = os.stat(path).st_mtime
+                stored = json_backend.load_file(path)
+                entry = self._remember_entry(key, stored['etag'], stored['hashes'], checked_at)
+            except (OSError, ValueError, KeyError):
+                return None
+        return entry
+
+    def _fetch_entry(self, key, revalidate=False):
+        """Return the cache entry for key, or None if the object does not exist"""
+        entry = self._cached_entry(key)
+        if entry is not None and not revalidate and time.time() - entry['checked_at'] < self.cache_ttl:
+            return entry
+
+        request = {}
+        if entry is not None and entry['etag']:
+            request['IfNoneMatch'] = entry['etag']
+        try:
+            body, etag = self._download(key, **request)
+        except self.s3_client.exceptions.NoSuchKey:
+            self._drop_entry(key)
+            return None
+        except self.s3_client.exceptions.ClientError as e:
+            if entry is None or e.response.get('ResponseMetadata', {}).get('HTTPStatusCode') != 304:
+                raise
+            # Not modified: the cached copy is still current
+            self._mark_checked(key, entry)
+            return entry
+        data = json_backend.loads(body)
+        return self._store_entry(key, etag, data.get('hashes', []))
+
+    def _download(self, key, **request):
+        return download_object(self.s3_client, self.bucket_name, key, self.download_chunk_bytes,
+                               self.download_concurrency, **request)
+
+    def _read_hash_object(self, key, revalidate=False):
+        """Read the hash list stored at key, or None if the object does not exist"""
+        entry = self._fetch_entry(key, revalidate=revalidate)
+        return None if entry is None else list(entry['hashes'])
+
+    def _write_hash_object(self, key, hashes):
+        data = {
+            'hashes': hashes,
+            'lastUpdated': datetime.utcnow().isoformat() + 'Z'
+        }
+        response = self.s3_client.put_object(
+            Bucket=self.bucket_name,
+            Key=key,
+            Body=json_backend.dumps(data),
+            ContentType='application/json'
+        )
+        # Write-through, so our own update does not cost a re-download
+        self._store_entry(key, response.get('ETag'), list(hashes))
+
+    # --- Sharded layout -------------------------------------------------
+
+    def _shard_key(self, prefix):
+        return f"{self.shard_root}/{prefix}.json"
+
+    def get_manifest(self, refresh=False):
+        """Fetch the shard manifest, creating it with ``shard_prefix_len`` if missing
+
+        The manifest is ``{'prefixLength': n, 'reshardingFrom': m or None}``.
+        While ``reshardingFrom`` is set, hashes may still live in shards of
+        the old prefix length, so lookups and removals check both.
+        """
+        if self._manifest is not None and not refresh:
+            return self._manifest
+        try:
+            self._manifest = json_backend.loads(self._download(self.manifest_key)[0])
+        except self.s3_client.exceptions.NoSuchKey:
+            self._write_manifest(self.shard_prefix_len, None)
+        return self._manifest
+
+    def _write_manifest(self, prefix_len, resharding_from):
+        self._manifest = {
+            'prefixLength': prefix_len,
+            'reshardingFrom': resharding_from,
+            'lastUpdated': datetime.utcnow().isoformat() + 'Z'
+        }
+        self.s3_client.put_object(
+            Bucket=self.bucket_name,
+            Key=self.manifest_key,
+            Body=json_backend.dumps(self._manifest),
+            ContentType='application/json'
+        )
+
+    def _shard_keys_for(self, hash_value, refresh=False):
+        """Shard keys that may hold hash_value, current prefix length first"""
+        manifest = self.get_manifest(refresh=refresh)
+        lengths = [manifest['prefixLength']]
+        if manifest.get('reshardingFrom') is not None:
+            lengths.append(manifest['reshardingFrom'])
+        return [self._shard_key(hash_value[:length].lower()) for length in lengths]
+
+    def _shard_contains(self, hash_value, revalidate=False):
+        shards = [self._fetch_entry(key, revalidate=revalidate) for key in self._shard_keys_for(hash_value)]
+        if any(entry is not None and hash_value in entry['set'] for entry in shards):
             return True
+        if None in shards:
+            # A missing shard may mean a reshard finished since the manifest was cached
+            cached = self._manifest
+            if self.get_manifest(refresh=True) != cached:
+                for key in self._shard_keys_for(hash_value):
+                    entry = self._fetch_entry(key, revalidate=revalidate)
+                    if entry is not None and hash_value in entry['set']:
+                        return True
         return False
 
+    def _list_shard_keys(self):
+        """Map prefix length -> shard keys currently stored under the shard root"""
+        keys = {}
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=self.shard_root + '/'):
+            for obj in page.get('Contents', []):
+                if obj['Key'] == self.manifest_key:
+                    continue
+                prefix = posixpath.splitext(posixpath.basename(obj['Key']))[0]
+                keys.setdefault(len(prefix), []).append(obj['Key'])
+        return keys
+
+    def _get_all_shard_hashes(self):
+        hashes = []
+        seen = set()
+        for keys in self._list_shard_keys().values():
+            for key in keys:
+                for hash_value in self._read_hash_object(key) or []:
+                    if hash_value not in seen:
+                        seen.add(hash_value)
+                        hashes.append(hash_value)
+        return hashes
+
+    def _replace_all_shards(self, new_hashes):
+        try:
+            prefix_len = self.get_manifest(refresh=True)['prefixLength']
+            grouped = self._group_by_prefix(new_hashes, prefix_len)
+            for keys in self._list_shard_keys().values():
+                for key in keys:
+                    grouped.setdefault(key, [])
+            for key, hashes in grouped.items():
+                self._write_hash_object(key, hashes)
+            return True
+        except Exception as e:
+            logging.error(f"Error updating remote hashes: {str(e)}")
+
+    def _group_by_prefix(self, hashes, prefix_len):
+        grouped = {}
+        for hash_value in hashes:
+            grouped.setdefault(self._shard_key(hash_value[:prefix_len].lower()), []).append(hash_value)
+        return grouped
+
+    def _add_shard_hash(self, new_hash):
+        try:
+            # Writers re-read the manifest so inserts follow an in-progress reshard
+            keys = self._shard_keys_for(new_hash, refresh=True)
+            current_hashes = self._read_hash_object(keys[0], revalidate=True) or []
+            if new_hash in current_hashes or \
+               any(new_hash in (self._read_hash_object(key, revalidate=True) or []) for key in keys[1:]):
+                return False
+            current_hashes.append(new_hash)
+            self._write_hash_object(keys[0], current_hashes)
+            return True
+        except Exception as e:
+            logging.error(f"Error adding hash to shard: {str(e)}")
+            return None
+
+    def _remove_shard_hash(self, hash_to_remove):
+        removed = False
+        try:
+            for key in self._shard_keys_for(hash_to_remove, refresh=True):
+                current_hashes = self._read_hash_object(key, revalidate=True) or []
+                if hash_to_remove in current_hashes:
+                    current_hashes.remove(hash_to_remove)
+                    self._write_hash_object(key, current_hashes)
+                    removed = True
+        except Exception as e:
+            logging.error(f"Error removing hash from shard: {str(e)}")
+            return None
+        return removed
+
+    def _merge_into_shards(self, grouped):
+        for key, hashes in grouped.items():
+            current_hashes = self._read_hash_object(key, revalidate=True) or []
+            known = set(current_hashes)
+            current_hashes.extend(h for h in hashes if h not in known)
+            self._write_hash_object(key, current_hashes)
+
+    def migrate_to_sharded(self, prefix_len=None):
+        """Copy the single-file store at ``remote_file_key`` into prefix shards
+
+        The single file is left in place so readers still on the old layout
+        keep working; delete it once every writer uses the sharded layout.
+
+        Returns:
+            int: Number of hashes copied
+        """
+        prefix_len = prefix_len or self.shard_prefix_len
+        hashes = self._read_hash_object(self.remote_file_key, revalidate=True) or []
+        self._merge_into_shards(self._group_by_prefix(hashes, prefix_len))
+        self._write_manifest(prefix_len, None)
+        self.layout = SHARDED_LAYOUT
+        return len(hashes)
+
+    def reshard(self, new_prefix_len):
+        """Move every shard to a new prefix length while the store stays online
+
+        The manifest first announces the new length with ``reshardingFrom``
+        set, so inserts go to new shards while lookups also consult the old
+        ones. Once all old shards are copied the manifest is finalized and the
+        old shards are deleted.
+
+        Returns:
+            int: Number of old shards moved
+        """
+        manifest = self.get_manifest(refresh=True)
+        old_prefix_len = manifest.get('reshardingFrom') or manifest['prefixLength']
+        if old_prefix_len == new_prefix_len:
+            return 0
+        self._write_manifest(new_prefix_len, old_prefix_len)
+
+        old_keys = self._list_shard_keys().get(old_prefix_len, [])
+        for key in old_keys:
+            hashes = self._read_hash_object(key, revalidate=True) or []
+            self._merge_into_shards(self._group_by_prefix(hashes, new_prefix_len))
+
+        self._write_manifest(new_prefix_len, None)
+        for key in old_keys:
+            self.s3_client.delete_object(Bucket=self.bucket_name, Key=key)
+            self._drop_entry(key)
+        return len(old_keys)
+
     def generate_hash(self, input_string):
         """Generate a SHA-256 hash from an input string
         
@@ -94,3 +450,38 @@ class HashManager:
         # Encode the string to bytes and generate hash
         hash_object = hashlib.sha256(str(input_string).encode())
         return hash_object.hexdigest()
+
+    @staticmethod
+    def generate_content_hash(entries):
+        """Generate a canonical SHA-256 fingerprint of a location history
+
+        Each entry is serialized with sorted keys and compact separators and fed
+        to an incremental SHA-256, so the digest does not depend on key order or
+        whitespace of the export, and memory stays constant when ``entries`` is
+        a streaming iterator.
+
+        Args:
+            entries (Iterable): The history entries / segments, in order
+
+        Returns:
+            str: The hexadecimal representation of the hash
+        """
+        hash_object = hashlib.sha256()
+        for entry in entries:
+            hash_object.update(HashManager.canonical_entry(entry))
+        return hash_object.hexdigest()
+
+    @staticmethod
+    def canonical_entry(entry):
+        """Serialize one entry the way ``generate_content_hash`` feeds it to SHA-256
+
+        Args:
+            entry: A history entry / segment
+
+        Returns:
+            bytes: The entry as compact, key-sorted UTF-8 JSON plus a newline
+                (lone surrogates encoded as their UTF-8 byte patterns)
+        """
+        canonical = json.dumps(entry, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+        # Lone surrogates ("\ud800") are valid JSON but not UTF-8
+        return canonical.encode('utf-8', 'surrogatepass') + b'\n'
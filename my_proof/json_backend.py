@@ -0,0 +1,183 @@
+"""JSON decoding with the fastest installed backend.
+
+Exports, hash stores and reference files are decoded with ``orjson`` or
+``simdjson`` when one is installed (``pip install orjson``) and with the
+stdlib ``json`` module otherwise. Results are identical either way: input a
+fast backend would read differently from the stdlib is decoded by the stdlib
+instead. That covers whatever the backend rejects (NaN and Infinity literals,
+lone surrogates, a UTF-8 BOM) and integers outside the 64-bit range, which
+``orjson`` turns into floats. Those are caught after decoding: a document of
+few containers (a hash store) is checked for huge floats directly, one of
+many small objects (an export) by a scan of its bytes for long digit runs.
+
+Set ``JSON_BACKEND`` to ``orjson``, ``simdjson`` or ``json`` to choose one.
+"""
+import json
+import os
+from typing import Any, Callable, Dict, List, Optional, Union
+
+BACKENDS = ('orjson', 'simdjson', 'json')
+
+JsonInput = Union[str, bytes, bytearray, memoryview]
+
+
+def _digit_runs_table() -> bytes:
+    # Digits become '0', the bytes a JSON number can follow ('[', ',', ':',
+    # whitespace, and the sign) become a blank and everything else an 'x': a
+    # blank followed by 19 zeros then starts an integer a fast backend may
+    # not hold exactly. Digits after a quote, letter or '.' (hex hashes,
+    # fractions, exponents) do not count
+    table = bytearray(b'x' * 256)
+    table[ord('0'):ord('9') + 1] = b'0' * 10
+    for char in b'[,: \t\n\r-':
+        table[char] = ord(' ')
+    return bytes(table)
+
+
+_DIGIT_RUNS = _digit_runs_table()
+_LONG_INTEGER = b' ' + b'0' * 19
+_SCAN_BLOCK = 16 << 20
+# Integers a fast backend turns into floats are at least this large
+_LOSSY_MAGNITUDE = float(1 << 63)
+# Containers ``_has_large_float`` visits before leaving it to the byte scan
+_WALK_BUDGET = 4096
+
+
+def _has_large_float(document: Any) -> Optional[bool]:
+    """Whether a decoded document holds a float of magnitude 2**63 or more.
+
+    Returns None once more than ``_WALK_BUDGET`` containers were visited:
+    for documents made of many small objects the byte scan is cheaper.
+    """
+    stack = [document]
+    for _ in range(_WALK_BUDGET):
+        if not stack:
+            return False
+        node = stack.pop()
+        values = node.values() if type(node) is dict else node
+        kinds = set(map(type, values))
+        if float in kinds and any(type(v) is float and abs(v) >= _LOSSY_MAGNITUDE for v in values):
+            return True
+        if dict in kinds or list in kinds:
+            stack.extend(v for v in values if type(v) is dict or type(v) is list)
+    return None if stack else False
+
+
+def _may_hold_long_integer(data: Union[bytes, bytearray, memoryview]) -> bool:
+    """Whether ``data`` has a number starting with 19 or more digits."""
+    view = memoryview(data)
+    for start in range(0, len(view), _SCAN_BLOCK):
+        # Blocks overlap by one run, plus the character before it
+        lo = max(0, start - len(_LONG_INTEGER))
+        digits = bytes(view[lo:start + _SCAN_BLOCK]).translate(_DIGIT_RUNS)
+        # The bare run is far quicker to search for and often absent
+        if _LONG_INTEGER[1:] not in digits:
+            continue
+        # rfind compares the (rare) leading blank first, find the (common) last '0'
+        if digits.rfind(_LONG_INTEGER) >= 0 or (lo == 0 and digits.startswith(_LONG_INTEGER[1:])):
+            return True
+    return False
+
+
+def _stdlib_loads(data: JsonInput) -> Any:
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def _stdlib_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def _import_backend(name: str) -> Optional[Dict[str, Callable]]:
+    """Return the loads/dumps pair of a backend, or None if it is not installed."""
+    if name == 'json':
+        return {'loads': _stdlib_loads, 'dumps': _stdlib_dumps}
+    try:
+        if name == 'orjson':
+            import orjson
+            return {'loads': orjson.loads, 'dumps': orjson.dumps}
+        if name == 'simdjson':
+            import simdjson
+            return {'loads': simdjson.loads, 'dumps': _stdlib_dumps}
+    except ImportError:
+        return None
+    raise ValueError(f"Unknown JSON backend: {name}")
+
+
+class JsonBackend:
+    """A JSON decoder/encoder pair that falls back to the stdlib where it would differ from it."""
+
+    def __init__(self, name: str):
+        functions = _import_backend(name)
+        if functions is None:
+            raise ImportError(f"JSON backend {name} is not installed")
+        self.name = name
+        self._loads = functions['loads']
+        self._dumps = functions['dumps']
+
+    def loads(self, data: JsonInput) -> Any:
+        """Decode a document from text or UTF-8 bytes, exactly as ``json.loads`` would."""
+        if self.name == 'json':
+            return _stdlib_loads(data)
+        if isinstance(data, str):
+            try:
+                data = data.encode('utf-8')
+            except UnicodeEncodeError:
+                # Lone surrogates
+                return _stdlib_loads(data)
+        try:
+            document = self._loads(data)
+        except ValueError:
+            return _stdlib_loads(data)
+        if type(document) is float:
+            lossy = abs(document) >= _LOSSY_MAGNITUDE
+        elif type(document) in (dict, list):
+            lossy = _has_large_float(document)
+        else:
+            lossy = False
+        if lossy is None:
+            lossy = _may_hold_long_integer(data)
+        return _stdlib_loads(data) if lossy else document
+
+    def load_file(self, path: str) -> Any:
+        with open(path, 'rb') as f:
+            return self.loads(f.read())
+
+    def dumps(self, obj: Any) -> bytes:
+        """Encode compactly (no whitespace, non-ASCII kept as UTF-8)."""
+        return self._dumps(obj)
+
+
+def available_backends() -> List[str]:
+    return [name for name in BACKENDS if _import_backend(name) is not None]
+
+
+def get_backend(name: Optional[str] = None) -> JsonBackend:
+    """Return the named backend, by default ``JSON_BACKEND`` or the fastest one installed."""
+    name = name or os.environ.get('JSON_BACKEND')
+    if name:
+        return JsonBackend(name)
+    return JsonBackend(available_backends()[0])
+
+
+_default = None
+
+
+def default_backend() -> JsonBackend:
+    global _default
+    if _default is None:
+        _default = get_backend()
+    return _default
+
+
+def loads(data: JsonInput) -> Any:
+    return default_backend().loads(data)
+
+
+def load_file(path: str) -> Any:
+    return default_backend().load_file(path)
+
+
+def dumps(obj: Any) -> bytes:
+    return default_backend().dumps(obj)
@@ -0,0 +1,46 @@
+"""Migrate the remote hash store between layouts.
+
+Copy the single-file store into prefix shards:
+    python -m my_proof.migrate_hashes --bucket BUCKET --key hashes.json --prefix-len 2
+
+Reshard an existing sharded store online (e.g. as it grows):
+    python -m my_proof.migrate_hashes --bucket BUCKET --key hashes.json --reshard 3
+
+Credentials are read from AWS_ACCESS_KEY_ID / AWS_SECRET_ACCESS_KEY.
+"""
+import argparse
+import logging
+import os
+
+from my_proof.hash_manager import SHARDED_LAYOUT, HashManager
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    arg_parser = argparse.ArgumentParser(description="Migrate the remote hash store between layouts")
+    arg_parser.add_argument('--bucket', required=True)
+    arg_parser.add_argument('--key', required=True, help="remote_file_key of the store")
+    arg_parser.add_argument('--prefix-len', type=int, default=2,
+                            help="hex digits per shard prefix when migrating from a single file")
+    arg_parser.add_argument('--reshard', type=int, metavar='PREFIX_LEN',
+                            help="move an existing sharded store to a new prefix length")
+    args = arg_parser.parse_args()
+
+    hash_manager = HashManager(
+        bucket_name=args.bucket,
+        remote_file_key=args.key,
+        aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
+        aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY'),
+        layout=SHARDED_LAYOUT,
+        shard_prefix_len=args.prefix_len,
+    )
+    if args.reshard is not None:
+        moved = hash_manager.reshard(args.reshard)
+        logging.info(f"Resharded {moved} shards to prefix length {args.reshard}")
+    else:
+        copied = hash_manager.migrate_to_sharded(args.prefix_len)
+        logging.info(f"Copied {copied} hashes into shards under {hash_manager.shard_root}/")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""Parallel decoding of large location history exports.
+
+``json.load`` decodes a whole export on one core, which for a 1 GB history
+takes longer than validating it. ``decode_parallel`` instead memory-maps the
+file and splits the history array (the top-level iOS array or the Android
+``semanticSegments`` member) into byte ranges of whole elements. Worker
+processes decode and normalize one range each and send back its
+``SegmentColumns`` (a few typed arrays, cheap to pickle) rather than a tree
+of dicts, and the parent appends them to a ``SegmentStore`` in file order.
+Only a few ranges per worker are in flight at a time, so results (and the
+canonical bytes hashed for uniqueness) do not pile up in the parent. Workers
+are started from a fork server (or spawned) rather than forked, since the
+parent may have threads running, such as remote fetches.
+
+Finding the ranges only needs the bracket depth at a few points of the array.
+It is computed in bulk per block of the mapped file with C-level bytes
+methods (see ``_scan_block``); Python steps token by token only over the
+few hundred bytes between a block end and the next element boundary.
+"""
+import hashlib
+import mmap
+import multiprocessing
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Optional, Tuple
+
+from my_proof import json_backend
+from my_proof.hash_manager import HashManager
+from my_proof.segments import SegmentColumns, SegmentStore
+from my_proof.streaming import history_offset
+
+DEFAULT_CHUNK_BYTES = 8 << 20
+# Ranges submitted ahead of the one being collected, per worker
+_IN_FLIGHT_PER_WORKER = 2
+
+_STRING = rb'"[^"\\]*(?:\\.[^"\\]*)*"'
+_STRINGS = re.compile(_STRING, re.DOTALL)
+# Everything up to the first string that is not closed before the end
+_COMPLETE_RUN = re.compile(rb'(?:[^"]+|' + _STRING + rb')*', re.DOTALL)
+_TOKENS = re.compile(_STRING + rb'|[\[\]{},]', re.DOTALL)
+# Quotes, brackets (braces folded into brackets) and backslashes
+_STRUCTURAL = b'"[]{}\\'
+_NOT_STRUCTURAL = bytes(sorted(set(range(256)) - set(_STRUCTURAL)))
+_NOT_BRACKET = bytes(sorted(set(range(256)) - set(b'[]{}')))
+_BRACKET_PAIRS = bytes.maketrans(b'{}', b'[]')
+_MAX_CANCEL_PASSES = 64
+_OPEN = frozenset(b'[{')
+_CLOSE = frozenset(b']}')
+_QUOTE, _COMMA = ord('"'), ord(',')
+# Bytes stepped through one token at a time when locating the end of the array
+_WALK_SPAN = 4096
+
+
+def _scan_block(block: bytes) -> Tuple[int, Optional[Tuple[int, int]]]:
+    """Return the string-safe prefix of a block and the bracket balance of that prefix.
+
+    ``block`` must start outside a string. The prefix is the longest one not
+    ending inside a string; its balance is (unmatched closing, unmatched
+    opening) brackets, or None for nesting too deep to cancel in a few
+    passes. The block is reduced to its quotes and brackets in one C-level
+    pass; strings are then dropped and adjacent ``[]`` pairs cancelled until
+    only ``]]..[[`` remains.
+    """
+    structure = block.translate(_BRACKET_PAIRS, _NOT_STRUCTURAL)
+    if b'\\"' in structure and b'\\"' in block:
+        # Possibly escaped quotes: match strings properly
+        cut = _COMPLETE_RUN.match(block).end()
+        brackets = _STRINGS.sub(b'', block[:cut]).translate(_BRACKET_PAIRS, _NOT_BRACKET)
+    else:
+        # Quotes alternate between opening and closing. Removing adjacent
+        # pairs first (most strings hold no brackets) keeps that so, and
+        # leaves the final split short
+        cut = len(block)
+        if structure.count(b'"') % 2:
+            cut = block.rfind(b'"')
+            structure = structure[:structure.rfind(b'"')]
+        brackets = structure.replace(b'""', b'')
+        if b'"' in brackets:
+            brackets = b''.join(brackets.split(b'"')[::2])
+    for _ in range(_MAX_CANCEL_PASSES):
+        if b'[]' not in brackets:
+            closes = len(brackets) - len(brackets.lstrip(b']'))
+            return cut, (closes, len(brackets) - closes)
+        brackets = brackets.replace(b'[]', b'')
+    return cut, None
+
+
+def _walk(buf, pos: int, end: int, depth: int, stop_at_comma: bool) -> Tuple[int, int, Optional[int]]:
+    """Step through tokens from ``pos`` (outside a string) up to ``end``.
+
+    Stops at the bracket closing the array (depth 0) or, with
+    ``stop_at_comma``, at a comma between two of its elements.
+
+    Returns:
+        (position, depth, the byte stopped at or None if ``end`` was reached)
+    """
+    for match in _TOKENS.finditer(buf, pos, end):
+        char = buf[match.start()]
+        if char == _QUOTE:
+            continue
+        if char in _OPEN:
+            depth += 1
+        elif char in _CLOSE:
+            depth -= 1
+            if depth == 0:
+                return match.start(), depth, char
+        elif depth == 1 and stop_at_comma:
+            return match.start(), depth, char
+    return end, depth, None
+
+
+def split_array(buf, start: int, chunk_bytes: int = DEFAULT_CHUNK_BYTES) -> Iterator[Tuple[int, int]]:
+    """Yield (begin, end) byte ranges of the elements of the JSON array opening at ``start``.
+
+    Each range holds whole, comma-separated elements and, except for the
+    last, spans at least ``chunk_bytes``.
+    """
+    depth = 1
+    begin = pos = start + 1
+    span = chunk_bytes
+    while True:
+        block = buf[pos:pos + span]
+        cut, balance = _scan_block(block)
+        if cut == 0:
+            # A string longer than the span
+            if pos + span >= len(buf):
+                raise ValueError("Unexpected end of JSON input")
+            span *= 2
+            continue
+        span = chunk_bytes
+        if balance is not None and balance[0] < depth:
+            # The array goes on past the block: end the range at the next element boundary
+            depth += balance[1] - balance[0]
+            pos, depth, char = _walk(buf, pos + cut, len(buf), depth, stop_at_comma=True)
+        else:
+            # The array ends in this block (or nests too deep to balance in
+            # bulk): halve the span holding the end before stepping through it
+            end = pos + cut
+            while balance is not None and end - pos > _WALK_SPAN:
+                head, balance = _scan_block(buf[pos:(pos + end) // 2])
+                if head == 0:
+                    break
+                if balance is not None and balance[0] < depth:
+                    depth += balance[1] - balance[0]
+                    pos += head
+                else:
+                    end = pos + head
+            pos, depth, char = _walk(buf, pos, end, depth, stop_at_comma=False)
+            if char is None:
+                continue
+        if char is None:
+            raise ValueError("Unexpected end of JSON input")
+        if char != _COMMA:
+            if buf[begin:pos].strip():
+                yield begin, pos
+            return
+        yield begin, pos
+        begin = pos = pos + 1
+
+
+def _decode_range(path: str, begin: int, end: int, validator,
+                  canonical: bool) -> Tuple[SegmentColumns, Optional[bytes]]:
+    """Worker: decode and normalize the elements in ``[begin, end)`` of ``path``."""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        entries = json_backend.loads(b'[' + buf[begin:end] + b']')
+    columns = SegmentColumns.from_rows(validator.segment_rows(entries))
+    if not canonical:
+        return columns, None
+    return columns, b''.join(map(HashManager.canonical_entry, entries))
+
+
+def decode_parallel(path: str, validator, key: Optional[str] = None, workers: Optional[int] = None,
+                    chunk_bytes: int = DEFAULT_CHUNK_BYTES, memory_budget: Optional[int] = None,
+                    content_hash: bool = False) -> Tuple[SegmentStore, Optional[str]]:
+    """Decode and normalize a history export on ``workers`` processes.
+
+    Args:
+        path: JSON export to read.
+        validator: Validator whose ``segment_rows`` normalizes the entries.
+        key: Member of the top-level object holding the history array (e.g.
+            'semanticSegments'); ``None`` when the file itself is the array.
+        workers: Worker processes (defaults to the CPU count).
+        chunk_bytes: Approximate size of the byte range decoded per task.
+        memory_budget: Passed on to the ``SegmentStore``.
+        content_hash: Also compute ``HashManager.generate_content_hash`` of
+            the entries; the workers serialize them, the parent only hashes.
+
+    Workers are not forked, so a script calling this needs the
+    ``if __name__ == '__main__'`` guard.
+
+    Returns:
+        (normalized segments in file order, content hash or None)
+    """
+    start = history_offset(path, key)
+    workers = workers or os.cpu_count() or 1
+    store = SegmentStore(memory_budget=memory_budget)
+    hash_object = hashlib.sha256() if content_hash else None
+
+    def collect(future) -> None:
+        columns, canonical = future.result()
+        store.append_columns(columns)
+        if hash_object is not None:
+            hash_object.update(canonical)
+
+    # Forking a process with live threads can deadlock the child
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    try:
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf, \
+                ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            # Ranges are submitted as the scan finds them, so decoding overlaps it
+            pending = deque()
+            for begin, end in split_array(buf, start, chunk_bytes):
+                pending.append(pool.submit(_decode_range, path, begin, end, validator, content_hash))
+                if len(pending) > _IN_FLIGHT_PER_WORKER * workers:
+                    collect(pending.popleft())
+            while pending:
+                collect(pending.popleft())
+    except BaseException:
+        store.close()
+        raise
+    if hash_object is None:
+        return store, None
+    return store, hash_object.hexdigest()
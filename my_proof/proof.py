@@ -1,10 +1,14 @@
-import json
 import logging
 import os
-from typing import Dict, Any, List, Union
+from typing import Dict, Any, Iterable, List, Optional, Tuple, Union
 from my_proof.models.proof_response import ProofResponse
 from .checks import LocationHistoryValidator
 from .android_validator import AndroidLocationHistoryValidator
+from .streaming import detect_format, iter_history, load_projected
+from .segment_cache import CACHE_EXTENSION, write_segment_cache
+from .remote_fetch import RemoteFetches
+from .hash_manager import SINGLE_LAYOUT, HashManager
+from . import json_backend
 
 class Proof:
     def __init__(self, config: Dict[str, Any]):
@@ -14,23 +18,114 @@ class Proof:
 
     def generate(self) -> ProofResponse:
         print("Starting generate method")
+        # Remote lookups start first so they overlap parsing and validation
+        with RemoteFetches(timeout=self.config.get('remote_timeout_s') or 30.0) as remote:
+            if self.config.get('hash_bucket') and self.config.get('hash_file_key'):
+                remote.start('hash_store', self._fetch_hash_store)
+            return self._generate(remote)
+
+    def _fetch_hash_store(self):
+        hash_manager = HashManager(
+            bucket_name=self.config['hash_bucket'],
+            remote_file_key=self.config['hash_file_key'],
+            aws_access_key_id=os.environ.get('AWS_ACCESS_KEY_ID'),
+            aws_secret_access_key=os.environ.get('AWS_SECRET_ACCESS_KEY'),
+            layout=self.config.get('hash_store_layout') or SINGLE_LAYOUT,
+            shard_prefix_len=self.config.get('hash_shard_prefix_len') or 2,
+            cache_dir=self.config.get('hash_cache_dir'),
+            cache_ttl=self.config.get('hash_cache_ttl_s') or 0.0,
+            download_chunk_bytes=int((self.config.get('download_chunk_mb') or 8) * (1 << 20)),
+            download_concurrency=self.config.get('download_concurrency') or 8,
+            timeout=self.config.get('remote_timeout_s') or 30.0,
+        )
+        if hash_manager.layout == SINGLE_LAYOUT:
+            # A store that cannot be read fails the fetch rather than looking
+            # empty, and a cached copy is checked against S3 before deciding
+            return hash_manager, set(hash_manager.get_remote_hashes(revalidate=True, strict=True))
+        # Sharded lookups need the fingerprint, so only the manifest is prefetched
+        hash_manager.get_manifest()
+        return hash_manager, None
+
+    def _check_uniqueness(self, remote: RemoteFetches, input_hash: str) -> float:
+        """Score 0.0 if the submission is already in the remote hash store, else record it.
+
+        The outcome is reported in the ``uniqueness_check`` attribute. A store
+        that cannot be read scores 0.0 ("unavailable") and is not written to.
+        """
+        attributes = self.proof_response.attributes
+        fetched = remote.result('hash_store')
+        if fetched is None:
+            print("Hash store unavailable, uniqueness unknown")
+            attributes['uniqueness_check'] = 'unavailable'
+            return 0.0
+        hash_manager, remote_hashes = fetched
+        if remote_hashes is None:
+            try:
+                present = hash_manager.contains_hash(input_hash, strict=True, revalidate=True)
+            except Exception as e:
+                logging.error(f"Error looking up submission hash: {str(e)}")
+                attributes['uniqueness_check'] = 'unavailable'
+                return 0.0
+        else:
+            present = input_hash in remote_hashes
+        if present:
+            print("Submission already present in hash store")
+            attributes['uniqueness_check'] = 'duplicate'
+            return 0.0
+        # Record the submission so later copies of it score 0.0. The store is
+        # re-read first, so a copy recorded since the lookup is caught here
+        added = hash_manager.add_hash(input_hash)
+        if added is False:
+            print("Submission already present in hash store")
+            attributes['uniqueness_check'] = 'duplicate'
+            return 0.0
+        attributes['uniqueness_check'] = 'recorded' if added else 'not_recorded'
+        return 1.0
+
+    def _generate(self, remote: RemoteFetches) -> ProofResponse:
+        memory_budget_mb = self.config.get('memory_budget_mb')
+        decode_workers = self.config.get('decode_workers') or 0
         input_data = None
+        input_path = None
+        parallel_input = None
+        input_hash = None
+        cache_path = None
         for input_filename in os.listdir(self.config['input_dir']):
             input_file = os.path.join(self.config['input_dir'], input_filename)
-            if os.path.splitext(input_file)[1].lower() == '.zip':
+            extension = os.path.splitext(input_file)[1].lower()
+            # Segment caches are only read by the operator's re-scoring tool
+            # (python -m my_proof.segment_cache): a submitted one could hold
+            # any columns, and has no content to fingerprint for uniqueness
+            if extension == '.zip':
+                if self.config.get('segment_cache_dir'):
+                    cache_path = os.path.join(self.config['segment_cache_dir'],
+                                              os.path.splitext(input_filename)[0] + CACHE_EXTENSION)
                 print(f"Reading file: {input_file}")
+                if memory_budget_mb:
+                    # Bounded-memory mode streams the entries during validation
+                    input_path = input_file
+                    continue
+                if decode_workers > 1:
+                    # Worker processes decode the export straight into segment columns
+                    parallel_input = input_file
+                    continue
                 # Read as regular JSON file despite .zip extension
-                with open(input_file, 'r', encoding='utf-8') as f:
-                    input_data = json.load(f)
+                input_data = load_input(input_file)
 
-        if input_data is None:
+        if input_data is None and input_path is None and parallel_input is None:
             print("No valid JSON data found")
             self.proof_response.valid = False
             self.proof_response.score = 0.0
             return self.proof_response
 
         print("Calculating quality score...")
-        qualityRes = Quality(input_data)
+        if input_path is not None:
+            qualityRes = StreamingQuality(input_path, int(memory_budget_mb * 1024 * 1024), cache_path)
+        elif parallel_input is not None:
+            qualityRes, input_hash = ParallelQuality(parallel_input, decode_workers, cache_path,
+                                                     content_hash='hash_store' in remote)
+        else:
+            qualityRes = Quality(input_data, cache_path, self.config.get('approximate_validation', False))
         print(f"Quality score: {qualityRes}")
         
         # Initialize proof response values
@@ -46,10 +141,47 @@ class Proof:
             self.proof_response.score = 0.0
             return self.proof_response
 
+        if 'hash_store' in remote:
+            if input_hash is None:
+                entries = history_entries(input_data, input_path)
+                if entries is not None:
+                    # Fingerprint first: it is CPU work that can still overlap the fetch
+                    input_hash = HashManager.generate_content_hash(entries)
+            if input_hash is not None:
+                self.proof_response.uniqueness = self._check_uniqueness(remote, input_hash)
+            else:
+                print("No content hash for the submission, uniqueness unknown")
+                self.proof_response.attributes['uniqueness_check'] = 'unavailable'
+                self.proof_response.uniqueness = 0.0
+
         print(f"Final proof response: {self.proof_response.__dict__}")
         return self.proof_response
 
-def Quality(data_list: Union[List[Dict[str, Any]], Dict[str, Any]]) -> float:
+def load_input(input_file: str) -> Any:
+    """Parse an export, skipping the sections its validator does not read."""
+    validators = {'ios': LocationHistoryValidator, 'android': AndroidLocationHistoryValidator}
+    validator_class = validators.get(detect_format(input_file))
+    if validator_class is None or validator_class.projection is True:
+        return json_backend.load_file(input_file)
+    return load_projected(input_file, validator_class.projection)
+
+def history_entries(input_data: Any, input_path: Optional[str]) -> Optional[Iterable[Any]]:
+    """Return the timeline entries of a parsed or streamed input, or None if unrecognized."""
+    if input_path is not None:
+        data_format = detect_format(input_path)
+        if data_format == 'android':
+            return iter_history(input_path, key="semanticSegments")
+        if data_format == 'ios':
+            return iter_history(input_path)
+        return None
+    if isinstance(input_data, dict) and "semanticSegments" in input_data:
+        return input_data["semanticSegments"]
+    if isinstance(input_data, list):
+        return input_data
+    return None
+
+def Quality(data_list: Union[List[Dict[str, Any]], Dict[str, Any]], cache_path: Optional[str] = None,
+            approximate: bool = False) -> float:
     print("Starting Quality check")
 
     try:
@@ -65,12 +197,12 @@ def Quality(data_list: Union[List[Dict[str, Any]], Dict[str, Any]]) -> float:
             validator = AndroidLocationHistoryValidator(max_speed_m_s=44.44)
             # Extract the list from semanticSegments
             segments = data_list["semanticSegments"]
-            result = validator.validate(segments)
+            result = validator.validate(segments, cache_path=cache_path, approximate=approximate)
         elif isinstance(data_list, list):
             # iOS format
             print("Detected iOS format data")
             validator = LocationHistoryValidator(max_speed_m_s=44.44)
-            result = validator.validate(data_list)
+            result = validator.validate(data_list, cache_path=cache_path, approximate=approximate)
         else:
             print("Error: Unrecognized data format")
             print("Data must be either:")
@@ -83,3 +215,75 @@ def Quality(data_list: Union[List[Dict[str, Any]], Dict[str, Any]]) -> float:
     except Exception as e:
         print(f"Error in Quality check: {e}")
         return -1
+
+
+def StreamingQuality(input_file: str, memory_budget: int, cache_path: Optional[str] = None) -> float:
+    """Bounded-memory variant of ``Quality`` that streams entries from disk.
+
+    Entries are decoded one at a time and their normalized segments spill to
+    a temporary SQLite store once they outgrow ``memory_budget`` bytes.
+    """
+    print(f"Starting streaming Quality check (memory budget {memory_budget} bytes)")
+
+    try:
+        data_format = detect_format(input_file)
+        if data_format == 'android':
+            print("Detected Android format data")
+            validator = AndroidLocationHistoryValidator(max_speed_m_s=44.44)
+            segments = iter_history(input_file, key="semanticSegments")
+            result = validator.validate(segments, memory_budget=memory_budget, cache_path=cache_path)
+        elif data_format == 'ios':
+            print("Detected iOS format data")
+            validator = LocationHistoryValidator(max_speed_m_s=44.44)
+            result = validator.validate(iter_history(input_file), memory_budget=memory_budget,
+                                        cache_path=cache_path)
+        else:
+            print("Error: Unrecognized data format")
+            return -1
+
+        print(f"Quality validation result: {result}")
+        return result
+    except Exception as e:
+        print(f"Error in Quality check: {e}")
+        return -1
+
+
+def ParallelQuality(input_file: str, workers: int, cache_path: Optional[str] = None,
+                    content_hash: bool = False) -> Tuple[float, Optional[str]]:
+    """Variant of ``Quality`` that decodes the export on ``workers`` processes.
+
+    Returns the score and, with ``content_hash``, the uniqueness fingerprint
+    of the entries, which the workers serialize while they decode.
+    """
+    print(f"Starting parallel Quality check ({workers} workers)")
+
+    try:
+        # multiprocessing is only imported when decoding in parallel
+        from .parallel_decode import decode_parallel
+
+        data_format = detect_format(input_file)
+        if data_format == 'android':
+            print("Detected Android format data")
+            validator = AndroidLocationHistoryValidator(max_speed_m_s=44.44)
+            key = "semanticSegments"
+        elif data_format == 'ios':
+            print("Detected iOS format data")
+            validator = LocationHistoryValidator(max_speed_m_s=44.44)
+            key = None
+        else:
+            print("Error: Unrecognized data format")
+            return -1, None
+
+        store, input_hash = decode_parallel(input_file, validator, key, workers=workers,
+                                            content_hash=content_hash)
+        with store:
+            if cache_path:
+                write_segment_cache(cache_path, store, validator.data_format)
+                print(f"Wrote segment cache: {cache_path}")
+            result = validator.validate_store(store)
+
+        print(f"Quality validation result: {result}")
+        return result, input_hash
+    except Exception as e:
+        print(f"Error in Quality check: {e}")
+        return -1, None
@@ -0,0 +1,74 @@
+"""Background fetching of remote inputs so network I/O overlaps validation.
+
+S3 lookups (the uniqueness hash store, reference datasets such as the poison
+file) do not depend on the submission, so they can start the moment a run
+begins. ``RemoteFetches`` runs them on daemon threads while the main thread
+parses and validates, and the results are awaited only where they are
+needed, each with a timeout. A fetch still running when the run finishes is
+abandoned: the interpreter does not wait for daemon threads at exit, so a
+slow endpoint delays a proof by at most its timeout. Fetches should still
+bound their own I/O (see ``aws_interaction.s3_client``) so abandoned threads
+do not pile up in a long-lived process.
+"""
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError
+from typing import Any, Callable, Dict, Optional
+
+
+class RemoteFetches:
+    """Named background fetches with per-result timeouts and cancellation.
+
+    Args:
+        max_workers: Fetches allowed to run at once; later ones wait for a slot.
+        timeout: Default seconds to wait in ``result`` before giving up.
+    """
+
+    def __init__(self, max_workers: int = 4, timeout: float = 30.0):
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_workers)
+        self._futures: Dict[str, Future] = {}
+
+    def __enter__(self) -> 'RemoteFetches':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def start(self, name: str, fn: Callable[..., Any], *args, **kwargs) -> None:
+        """Run ``fn(*args, **kwargs)`` in the background under ``name``."""
+        future = Future()
+        self._futures[name] = future
+        threading.Thread(target=self._run, args=(future, fn, args, kwargs),
+                         name=f'remote-fetch-{name}', daemon=True).start()
+
+    def _run(self, future: Future, fn: Callable[..., Any], args, kwargs) -> None:
+        with self._slots:
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._futures
+
+    def result(self, name: str, default: Any = None, timeout: Optional[float] = None) -> Any:
+        """Wait for a fetch and return its result, or ``default`` on timeout or error."""
+        future = self._futures.get(name)
+        if future is None:
+            return default
+        try:
+            return future.result(timeout=self.timeout if timeout is None else timeout)
+        except TimeoutError:
+            future.cancel()
+            logging.error(f"Remote fetch '{name}' timed out")
+        except Exception as e:
+            logging.error(f"Remote fetch '{name}' failed: {str(e)}")
+        return default
+
+    def close(self) -> None:
+        """Cancel fetches that have not started and stop waiting on running ones."""
+        for future in self._futures.values():
+            future.cancel()
@@ -0,0 +1,297 @@
+"""Approximate validation on a stratified random sample of segments.
+
+For triage of very large exports an exact score is often unnecessary. In
+approximate mode only timestamps and segment fingerprints are computed for
+every entry; they feed the global checks (time order, regular
+intervals, duplicate segments) and the day coverage, which stay exact. The
+per-entry ratio checks (suspicious speed, probabilities, hierarchy levels,
+timeline paths, local travel, and spatial continuity judged on the
+transition into each sampled entry) are estimated from a random sample
+drawn evenly from consecutive blocks of the history (strata), using the
+combined ratio estimator; its confidence interval is the wider of the
+normal approximation and a Wilson score interval.
+
+The exact part is not free: fingerprints hash every visit and activity, and
+their coordinates are parsed in one bulk pass as in exact validation. The
+last visit or activity before each entry, which continuity needs for a
+sampled entry, is also found in one pass. On the iOS and Android exports
+measured, an approximate run took 60-75% of the time of an exact one,
+nearly all of it spent in the exact part.
+
+The sample doubles until the pass/fail decision is settled, i.e. the
+threshold lies outside the interval of the summed check scores, or until
+every entry has been sampled, at which point the result is exact.
+"""
+import math
+import random
+from array import array
+from statistics import NormalDist
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from my_proof.segments import (
+    COLUMN_NAMES, LEVEL_CHECKED, MISSING, RUN, SPEED_CHECKED, WALK,
+    CheckCounts, DayCoverage,
+    continuity_stats, duplicate_stats, interval_stats, to_micros,
+)
+
+# Checks estimated from the sample; the rest of CheckCounts.NAMES is exact
+SAMPLED_CHECKS = ('speed', 'probabilities', 'levels', 'paths', 'travel', 'continuity')
+
+
+class CheckEstimate:
+    """Point estimate and confidence interval of one check score."""
+
+    def __init__(self, name: str, estimate: float, lower: float, upper: float, exact: bool):
+        self.name = name
+        self.estimate = estimate
+        self.lower = lower
+        self.upper = upper
+        self.exact = exact
+
+    def __repr__(self) -> str:
+        return f"CheckEstimate({self.name}={self.estimate:.3f} [{self.lower:.3f}, {self.upper:.3f}])"
+
+
+def _previous_geo_indices(validator, data: Sequence[Dict[str, Any]]) -> array:
+    """Index of the last visit or activity before each entry, -1 for none.
+
+    Continuity skips other rows. Entries are visits or activities exactly
+    when they hold one of the validator's ``geo_keys``, so one pass over the
+    keys suffices.
+    """
+    keys = validator.geo_keys
+    previous = array('q')
+    last = -1
+    for i, entry in enumerate(data):
+        previous.append(last)
+        if any(key in entry for key in keys):
+            last = i
+    return previous
+
+
+def _sampled_pairs(validator, row: tuple, prev_row: Optional[tuple]) -> Tuple[Tuple[int, int], ...]:
+    """Per-entry (valid, total) of every sampled check, mirroring ``count_checks``.
+
+    Spatial continuity is judged on the transition from ``prev_row``, the
+    last visit or activity before it (see ``_previous_geo_indices``), into
+    ``row``.
+    """
+    (_, _, flags, _, speed, travel_speed, prob_valid, prob_total, level,
+     confidence, path_valid, path_total, *_) = row
+    speed_total = 1 if flags & SPEED_CHECKED else 0
+    level_total = 1 if flags & LEVEL_CHECKED else 0
+    travel_total = 1 if flags & (WALK | RUN) else 0
+    continuity_valid = continuity_total = 0
+    if prev_row is not None:
+        transition = {name: (prev_row[i], row[i]) for i, name in enumerate(COLUMN_NAMES)}
+        continuity_valid, continuity_total, _ = continuity_stats(transition, validator.max_continuity_gap_m)
+    return (
+        (int(speed_total and speed <= validator.max_speed_m_s), speed_total),
+        (prob_valid, prob_total),
+        (int(level_total and validator.level_ok(level, confidence)), level_total),
+        (path_valid, path_total),
+        (int(travel_total and ((flags & WALK and travel_speed <= validator.max_walk_speed) or
+                               (flags & RUN and travel_speed <= validator.max_run_speed))), travel_total),
+        (continuity_valid, continuity_total),
+    )
+
+
+class StratifiedSample:
+    """Grows a without-replacement random sample over equal blocks of a sequence."""
+
+    def __init__(self, size: int, strata: int, rng: random.Random):
+        strata = max(1, min(strata, size))
+        edges = [size * i // strata for i in range(strata + 1)]
+        self.bounds = [(lo, hi) for lo, hi in zip(edges, edges[1:]) if hi > lo]
+        self.taken = [set() for _ in self.bounds]
+        self.rng = rng
+
+    def exhausted(self) -> bool:
+        return all(len(taken) == hi - lo for taken, (lo, hi) in zip(self.taken, self.bounds))
+
+    def grow(self, per_stratum: int) -> List[Tuple[int, int]]:
+        """Top every stratum up to ``per_stratum`` indices; return the new (stratum, index) pairs."""
+        added = []
+        for h, ((lo, hi), taken) in enumerate(zip(self.bounds, self.taken)):
+            want = min(per_stratum, hi - lo) - len(taken)
+            if want <= 0:
+                continue
+            if len(taken) + want > (hi - lo) // 2:
+                remaining = [i for i in range(lo, hi) if i not in taken]
+                new = self.rng.sample(remaining, want)
+            else:
+                new = []
+                while len(new) < want:
+                    i = self.rng.randrange(lo, hi)
+                    if i not in taken:
+                        taken.add(i)
+                        new.append(i)
+            taken.update(new)
+            added.extend((h, i) for i in new)
+        return added
+
+
+def wilson_interval(p: float, n: float, z: float) -> Tuple[float, float]:
+    """Wilson score interval of a proportion ``p`` observed over ``n`` trials."""
+    if n <= 0:
+        return 0.0, 1.0
+    denominator = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+def _ratio_interval(strata: List[Dict[str, Any]], check: int, z: float) -> Tuple[float, float, float]:
+    """Combined ratio estimate and interval for one check across strata."""
+    y_hat = x_hat = 0.0
+    for stratum in strata:
+        n = len(stratum['pairs'])
+        if n:
+            y_hat += stratum['size'] * sum(p[check][0] for p in stratum['pairs']) / n
+            x_hat += stratum['size'] * sum(p[check][1] for p in stratum['pairs']) / n
+    if x_hat == 0:
+        complete = all(len(s['pairs']) == s['size'] for s in strata)
+        # Nothing checked in the sample: the exact rule scores 1.0, the truth may differ
+        return 1.0, (1.0 if complete else 0.0), 1.0
+
+    ratio = y_hat / x_hat
+    variance = 0.0
+    for stratum in strata:
+        n, size = len(stratum['pairs']), stratum['size']
+        if n < 2 or n == size:
+            continue
+        residuals = [p[check][0] - ratio * p[check][1] for p in stratum['pairs']]
+        mean = sum(residuals) / n
+        s2 = sum((r - mean) ** 2 for r in residuals) / (n - 1)
+        variance += size * size * (1 - n / size) * s2 / n
+    if all(len(s['pairs']) == s['size'] for s in strata):
+        return ratio, ratio, ratio
+
+    # The normal interval collapses when every sampled entry agrees (e.g. all
+    # valid); the Wilson interval over the checked units in the sample does not
+    half_width = z * math.sqrt(variance) / x_hat
+    checked = sum(p[check][1] for s in strata for p in s['pairs'])
+    wilson_lower, wilson_upper = wilson_interval(ratio, checked, z)
+    return (ratio, max(0.0, min(ratio - half_width, wilson_lower)),
+            min(1.0, max(ratio + half_width, wilson_upper)))
+
+
+def exact_counts(validator, data: Sequence[Dict[str, Any]]) -> CheckCounts:
+    """Exact time order, regular interval, duplicate segment, time span and coverage tallies."""
+    parse_time = validator.parse_time
+    columns = {
+        'start': array('q', (to_micros(parse_time(entry.get("startTime"))) for entry in data)),
+        'end': array('q', (to_micros(parse_time(entry.get("endTime"))) for entry in data)),
+    }
+    columns['fingerprint'] = array('q', validator.fingerprints(data, columns['start'], columns['end']))
+    counts = CheckCounts()
+    n = len(data)
+    if not n:
+        return counts
+
+    issues = 0
+    prev_end = MISSING
+    coverage = DayCoverage()
+    for start, end in zip(columns['start'], columns['end']):
+        coverage.add(start, end)
+        if start != MISSING and prev_end != MISSING and start < prev_end:
+            issues += 1
+        if start != MISSING and end != MISSING and end < start:
+            issues += 1
+        prev_end = end
+    counts.total['time_order'] = 2 * n - 1
+    counts.valid['time_order'] = counts.total['time_order'] - issues
+    counts.valid['intervals'], counts.total['intervals'] = interval_stats(columns)
+    counts.valid['duplicates'], counts.total['duplicates'] = duplicate_stats(columns)
+
+    starts = [t for t in columns['start'] if t != MISSING]
+    ends = [t for t in columns['end'] if t != MISSING]
+    counts.earliest = min(starts) if starts else None
+    counts.latest = max(ends) if ends else None
+    counts.covered_days = len(coverage)
+    return counts
+
+
+def estimate_checks(validator, data: Sequence[Dict[str, Any]], confidence: float = 0.95,
+                    initial_sample: int = 1000, strata: int = 10,
+                    seed: int = 0) -> Tuple[Dict[str, CheckEstimate], CheckCounts, int]:
+    """Estimate every check, sampling until the threshold decision is settled.
+
+    Returns:
+        (estimates keyed by ``CheckCounts.NAMES``, exact tallies of the
+        unsampled checks, number of entries sampled)
+    """
+    if not isinstance(data, Sequence):
+        data = list(data)
+
+    exact = exact_counts(validator, data)
+    previous_geo = _previous_geo_indices(validator, data)
+
+    n_checks = len(CheckCounts.NAMES)
+    threshold = n_checks * 0.1
+    # Bonferroni: each sampled interval gets an equal share of the error rate
+    z = NormalDist().inv_cdf(1 - (1 - confidence) / (2 * len(SAMPLED_CHECKS)))
+
+    rng = random.Random(seed)
+    sample = StratifiedSample(len(data), strata, rng)
+    strata_state = [{'size': hi - lo, 'pairs': []} for lo, hi in sample.bounds]
+    per_stratum = max(2, math.ceil(initial_sample / max(1, len(sample.bounds))))
+
+    while True:
+        for h, i in sample.grow(per_stratum):
+            j = previous_geo[i]
+            prev_row = validator.segment_row(data[j]) if j >= 0 else None
+            strata_state[h]['pairs'].append(_sampled_pairs(validator, validator.segment_row(data[i]), prev_row))
+
+        estimates = {}
+        for name in CheckCounts.NAMES:
+            if name in SAMPLED_CHECKS:
+                value, lower, upper = _ratio_interval(strata_state, SAMPLED_CHECKS.index(name), z)
+                estimates[name] = CheckEstimate(name, value, lower, upper, exact=sample.exhausted())
+            else:
+                value = exact.score(name)
+                estimates[name] = CheckEstimate(name, value, value, value, exact=True)
+
+        lower_sum = sum(e.lower for e in estimates.values())
+        upper_sum = sum(e.upper for e in estimates.values())
+        if lower_sum >= threshold or upper_sum < threshold or sample.exhausted():
+            return estimates, exact, sum(len(s['pairs']) for s in strata_state)
+        per_stratum *= 2
+
+
+def validate_sampled(validator, data: Sequence[Dict[str, Any]], confidence: float = 0.95,
+                     initial_sample: int = 1000) -> float:
+    """Approximate counterpart of ``validate`` (see module docstring)."""
+    if not isinstance(data, Sequence):
+        data = list(data)
+    print(f"\nStarting approximate validation with {len(data)} entries")
+    estimates, exact, sampled = estimate_checks(validator, data, confidence, initial_sample)
+    labels = [label for label, _ in validator.check_results(CheckCounts())]
+    print(f"Sampled {sampled} of {len(data)} entries ({confidence:.0%} confidence intervals)")
+
+    print("\nIndividual check results:")
+    for label, name in zip(labels, CheckCounts.NAMES):
+        e = estimates[name]
+        if e.exact or e.lower == e.upper:
+            print(f"{label}: {e.estimate:.3f}")
+        else:
+            print(f"{label}: {e.estimate:.3f} [{e.lower:.3f}, {e.upper:.3f}]")
+
+    valid = sum(e.estimate for e in estimates.values())
+    lower = sum(e.lower for e in estimates.values())
+    upper = sum(e.upper for e in estimates.values())
+    threshold = len(CheckCounts.NAMES) * 0.1
+    print(f"\nSum of all checks: {valid:.3f} [{lower:.3f}, {upper:.3f}]")
+    print(f"Minimum threshold: {threshold}")
+
+    # Sampling stops once the interval clears the threshold or the sample is
+    # exhaustive (lower == upper), so the lower bound decides either way
+    if lower < threshold:
+        print("Failed validation - returning -1")
+        return -1
+
+    print(f"\nTime span in days: {exact.time_span_days:.2f}")
+    print(f"Days with data: {exact.covered_days}")
+    final_score = exact.coverage_score
+    print(f"Final clamped score: {final_score:.3f}")
+    return final_score
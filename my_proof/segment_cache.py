@@ -0,0 +1,175 @@
+"""Memory-mapped columnar cache of normalized location histories.
+
+Re-scoring an archive of past submissions (after tuning thresholds or adding
+checks) would otherwise re-decode every JSON export and re-parse every
+timestamp. A cache file stores the ``segments.COLUMNS`` arrays of one history
+back to back; loading it maps the file and exposes each column as a typed
+``memoryview`` without decoding or copying anything.
+
+File layout::
+
+    MAGIC (8 bytes) | header length (uint32 LE) | JSON header | padding | columns
+
+The header records the source format, row count, byte order, schema version and the name,
+typecode, offset and size of every column. Columns start on 8-byte boundaries.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from typing import Iterator, Tuple
+
+from my_proof.segments import COLUMNS, SegmentStore, duplicate_stats, interval_stats
+
+MAGIC = b'VSEGCOL1'
+# Bumped when the meaning of stored values changes (2: GEO flags set without coordinates)
+SCHEMA_VERSION = 2
+CACHE_EXTENSION = '.segcol'
+_ALIGN = 8
+
+
+class CacheFormatError(ValueError):
+    """Raised when a cache file is corrupt or was written with other columns."""
+
+
+def _aligned(offset: int) -> int:
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def write_segment_cache(path: str, store: SegmentStore, data_format: str) -> None:
+    """Write the normalized columns of ``store`` to ``path``.
+
+    Args:
+        path: Destination file; written to a temp name and renamed into place.
+        store: Normalized segments (in memory or spilled to SQLite).
+        data_format: 'ios' or 'android', used to pick the validator on load.
+    """
+    rows = len(store)
+    columns = []
+    offset = 0
+    for name, code in COLUMNS:
+        nbytes = rows * struct.calcsize(code)
+        columns.append({'name': name, 'typecode': code, 'offset': offset, 'nbytes': nbytes})
+        offset = _aligned(offset + nbytes)
+
+    header = json.dumps({
+        'format': data_format,
+        'rows': rows,
+        'byteorder': sys.byteorder,
+        'schema': SCHEMA_VERSION,
+        'columns': columns,
+    }).encode('utf-8')
+    data_start = _aligned(len(MAGIC) + 4 + len(header))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<I', len(header)))
+        f.write(header)
+        for column in columns:
+            f.write(b'\0' * (data_start + column['offset'] - f.tell()))
+            # One pass per column keeps a spilled store's memory bounded
+            for chunk in store.chunks():
+                chunk[column['name']].tofile(f)
+    os.replace(tmp_path, path)
+
+
+class MappedSegments:
+    """Read-only, memory-mapped segment columns loaded from a cache file.
+
+    Provides the subset of the ``SegmentStore`` interface the validators use
+    (``len``, ``chunks``, ``interval_stats``, ``duplicate_stats``, ``spilled``,
+    ``close``), so a mapped cache can be passed straight to ``validate_store``.
+    """
+
+    spilled = False
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._load_header()
+        except Exception:
+            self.close()
+            raise
+
+    def _load_header(self) -> None:
+        buf = self._mmap
+        if len(buf) < len(MAGIC) + 4 or buf[:len(MAGIC)] != MAGIC:
+            raise CacheFormatError(f"{self.path} is not a segment cache file")
+        (header_len,) = struct.unpack_from('<I', buf, len(MAGIC))
+        header_start = len(MAGIC) + 4
+        header = json.loads(buf[header_start:header_start + header_len])
+        if header['byteorder'] != sys.byteorder:
+            raise CacheFormatError(f"{self.path} was written on a {header['byteorder']}-endian host")
+        stored = [(c['name'], c['typecode']) for c in header['columns']]
+        if stored != list(COLUMNS) or header.get('schema') != SCHEMA_VERSION:
+            raise CacheFormatError(f"{self.path} has stale columns; rebuild it from the source export")
+
+        self.data_format = header['format']
+        self.rows = header['rows']
+        data_start = _aligned(header_start + header_len)
+        view = memoryview(self._mmap)
+        self._views = [view]
+        self.arrays = {}
+        for column in header['columns']:
+            start = data_start + column['offset']
+            end = start + column['nbytes']
+            if end > len(buf):
+                raise CacheFormatError(f"{self.path} is truncated")
+            column_view = view[start:end].cast(column['typecode'])
+            self._views.append(column_view)
+            self.arrays[column['name']] = column_view
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def __getitem__(self, name: str) -> memoryview:
+        return self.arrays[name]
+
+    def __enter__(self) -> 'MappedSegments':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def chunks(self) -> Iterator['MappedSegments']:
+        if self.rows:
+            yield self
+
+    def interval_stats(self) -> Tuple[int, int]:
+        return interval_stats(self)
+
+    def duplicate_stats(self) -> Tuple[int, int]:
+        return duplicate_stats(self)
+
+    def close(self) -> None:
+        # Views must be released before the mapping can be closed
+        for view in reversed(getattr(self, '_views', [])):
+            view.release()
+        self._views = []
+        self.arrays = {}
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+
+def open_segment_cache(path: str) -> MappedSegments:
+    return MappedSegments(path)
+
+
+if __name__ == "__main__":
+    # Re-score cached histories: python -m my_proof.segment_cache FILE.segcol...
+    from my_proof.android_validator import AndroidLocationHistoryValidator
+    from my_proof.checks import LocationHistoryValidator
+
+    validators = {
+        'ios': LocationHistoryValidator(),
+        'android': AndroidLocationHistoryValidator(),
+    }
+    for cache_path in sys.argv[1:]:
+        with open_segment_cache(cache_path) as segments:
+            score = validators[segments.data_format].validate_store(segments)
+        print(f"{cache_path}: {score}")
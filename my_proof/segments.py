@@ -0,0 +1,499 @@
+"""Columnar segment storage shared by the location history validators.
+
+Every entry of a history is normalized into one row of fixed-width columns
+(timestamps as epoch microseconds, precomputed speeds and per-segment check
+counts), so all checks can be scored in a single pass over compact arrays
+instead of the parsed JSON.
+
+Rows are buffered in memory. When a memory budget is set and the buffer
+outgrows it, the rows spill to a temporary SQLite database and cross-segment
+state (such as the interval histogram behind the regular-intervals check and
+the distinct fingerprints behind the duplicate-segments check) is computed by
+SQLite on disk, so validation stays under a fixed RSS ceiling no
+matter how large the export is.
+"""
+import os
+import sqlite3
+import tempfile
+from array import array
+from datetime import datetime, timezone
+from hashlib import blake2b
+from itertools import islice
+from math import asin, cos, radians, sin, sqrt
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple
+
+# Sentinel for absent or unparsable timestamps and hierarchy levels
+MISSING = -(2 ** 63)
+NAN = float('nan')
+
+# Bits of the ``flags`` column
+SPEED_CHECKED = 1   # entry takes part in the suspicious speed check
+WALK = 2            # entry is a walking activity (local travel check)
+RUN = 4             # entry is a running activity (local travel check)
+LEVEL_CHECKED = 8   # entry takes part in the hierarchy level check
+GEO_ACTIVITY = 16   # activity (spatial continuity check); start/end coordinates NaN if missing
+GEO_VISIT = 32      # visit; its place location is stored as both start and end, NaN if missing
+
+COLUMNS = (
+    ('start', 'q'),          # startTime, epoch microseconds
+    ('end', 'q'),            # endTime, epoch microseconds
+    ('flags', 'B'),
+    ('distance', 'd'),       # activity distance in meters
+    ('speed', 'd'),          # m/s used by the suspicious speed check
+    ('travel_speed', 'd'),   # m/s used by the local travel check
+    ('prob_valid', 'I'),     # probabilities within [0, 1]
+    ('prob_total', 'I'),     # probabilities present
+    ('level', 'q'),          # visit hierarchy level (iOS)
+    ('confidence', 'd'),     # place location confidence (Android)
+    ('path_valid', 'I'),     # valid timeline path / waypoint fields
+    ('path_total', 'I'),     # timeline path / waypoint fields checked
+    ('start_lat', 'd'),      # where the segment starts, degrees
+    ('start_lng', 'd'),
+    ('end_lat', 'd'),        # where the segment ends, degrees
+    ('end_lng', 'd'),
+    ('fingerprint', 'q'),    # segment identity hash (duplicate check), 0 if none
+)
+COLUMN_NAMES = tuple(name for name, _ in COLUMNS)
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROS_PER_SECOND = 1_000_000
+_MICROS_PER_DAY = 86400 * _MICROS_PER_SECOND
+# Days with data for a full final score
+FULL_COVERAGE_DAYS = 60
+# Days a single segment can cover, so one long visit cannot stand in for a
+# dense history while a multi-day stay still counts in full
+MAX_SEGMENT_DAYS = 7
+_EARTH_RADIUS_M = 6371_000
+# Coordinates are compared on a grid of 1e-4 degrees (about 11 m)
+_FINGERPRINT_GRID_DECIMALS = 4
+
+
+def to_micros(dt: Optional[datetime]) -> int:
+    """Convert a datetime to integer epoch microseconds (naive is taken as UTC)."""
+    if dt is None:
+        return MISSING
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    delta = dt - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * _MICROS_PER_SECOND + delta.microseconds
+
+
+def speed_between(distance_meters: float, start: int, end: int) -> float:
+    """Speed in m/s between two epoch-microsecond timestamps, 0.0 if undefined."""
+    if start == MISSING or end == MISSING or end <= start:
+        return 0.0
+    return distance_meters / ((end - start) / _MICROS_PER_SECOND)
+
+
+def segment_row(start: int = MISSING, end: int = MISSING, flags: int = 0,
+                distance: float = NAN, speed: float = 0.0, travel_speed: float = 0.0,
+                prob_valid: int = 0, prob_total: int = 0,
+                level: int = MISSING, confidence: float = NAN,
+                path_valid: int = 0, path_total: int = 0,
+                start_lat: float = NAN, start_lng: float = NAN,
+                end_lat: float = NAN, end_lng: float = NAN, fingerprint: int = 0) -> tuple:
+    """Build one normalized row in ``COLUMNS`` order."""
+    return (start, end, flags, distance, speed, travel_speed, prob_valid, prob_total,
+            level, confidence, path_valid, path_total, start_lat, start_lng, end_lat, end_lng,
+            fingerprint)
+
+
+def segment_fingerprint(kind: str, place: Any, start: int, end: int, distance: float = NAN,
+                        coords: Tuple[float, ...] = ()) -> int:
+    """Signed 64-bit hash of what a segment is, for the duplicate segment check.
+
+    Segments match when they have the same ``kind`` (e.g. visit or activity
+    type), the same ``place`` identifier, coordinates on the same grid cell,
+    the same whole-second duration and the same whole-meter distance. The
+    result is never 0, which marks rows without a fingerprint.
+    """
+    duration = (end - start) // _MICROS_PER_SECOND if start != MISSING and end != MISSING else None
+    key = (kind, place, duration, round(distance, 0),
+           tuple(round(c, _FINGERPRINT_GRID_DECIMALS) for c in coords))
+    digest = blake2b(repr(key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little', signed=True) or 1
+
+
+def haversine_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance in meters between two points given in degrees."""
+    phi1, phi2 = radians(lat1), radians(lat2)
+    a = sin((phi2 - phi1) / 2) ** 2 + cos(phi1) * cos(phi2) * sin(radians(lng2 - lng1) / 2) ** 2
+    return 2 * _EARTH_RADIUS_M * asin(sqrt(min(a, 1.0)))
+
+
+class SegmentColumns:
+    """A batch of normalized segments, one typed array per column."""
+
+    def __init__(self):
+        self.arrays = {name: array(code) for name, code in COLUMNS}
+        self._ordered = [self.arrays[name] for name in COLUMN_NAMES]
+
+    def __len__(self) -> int:
+        return len(self._ordered[0])
+
+    def __getitem__(self, name: str) -> array:
+        return self.arrays[name]
+
+    def append(self, row: tuple) -> None:
+        for column, value in zip(self._ordered, row):
+            column.append(value)
+
+    def extend(self, other: 'SegmentColumns') -> None:
+        for name, column in zip(COLUMN_NAMES, self._ordered):
+            column.extend(other[name])
+
+    def clear(self) -> None:
+        for column in self._ordered:
+            del column[:]
+
+    @staticmethod
+    def row_nbytes() -> int:
+        return sum(array(code).itemsize for _, code in COLUMNS)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[tuple]) -> 'SegmentColumns':
+        columns = cls()
+        for row in rows:
+            columns.append(row)
+        return columns
+
+
+def interval_stats(columns) -> Tuple[int, int]:
+    """Return (distinct, total) gaps between consecutive in-memory segments."""
+    gaps = set()
+    total = 0
+    for end_cur, start_next in zip(columns['end'], islice(columns['start'], 1, None)):
+        if end_cur != MISSING and start_next != MISSING:
+            gaps.add(start_next - end_cur)
+            total += 1
+    return len(gaps), total
+
+
+def duplicate_stats(columns) -> Tuple[int, int]:
+    """Return (distinct, total) fingerprints of in-memory segments, ignoring rows without one."""
+    fingerprints = columns['fingerprint']
+    distinct = set(fingerprints)
+    distinct.discard(0)
+    return len(distinct), sum(map(bool, fingerprints))
+
+
+def continuity_stats(columns, max_gap_m: float,
+                     prev: Tuple[int, float, float] = (0, NAN, NAN)) -> Tuple[int, int, Tuple[int, float, float]]:
+    """Count activity/visit transitions whose endpoints lie within ``max_gap_m``.
+
+    A transition is a visit followed by an activity (the activity's start
+    against the place) or an activity followed by a visit (its end against
+    the place). Rows that are neither (e.g. timeline paths) do not break the
+    chain, and a transition with a missing (NaN) coordinate fails. ``prev``
+    carries (kind flags, end_lat, end_lng) of the last visit or activity
+    before the batch, so a history can be scanned chunk by chunk.
+
+    Returns:
+        (transitions within tolerance, transitions checked, state for the next batch)
+    """
+    valid = total = 0
+    prev_kind, prev_lat, prev_lng = prev
+    for flags, start_lat, start_lng, end_lat, end_lng in zip(
+            columns['flags'], columns['start_lat'], columns['start_lng'],
+            columns['end_lat'], columns['end_lng']):
+        kind = flags & (GEO_ACTIVITY | GEO_VISIT)
+        if not kind:
+            continue
+        if prev_kind and kind != prev_kind:
+            total += 1
+            # False for NaN, so missing coordinates fail the transition
+            if haversine_m(prev_lat, prev_lng, start_lat, start_lng) <= max_gap_m:
+                valid += 1
+        prev_kind, prev_lat, prev_lng = kind, end_lat, end_lng
+    return valid, total, (prev_kind, prev_lat, prev_lng)
+
+
+class SegmentStore:
+    """Append-only segment table that spills to SQLite past a memory budget.
+
+    Args:
+        memory_budget: Bytes of column data to keep in memory before spilling
+            to disk. ``None`` keeps everything in memory.
+        spill_dir: Directory for the temporary SQLite file (defaults to the
+            system temp dir).
+        chunk_rows: Rows per batch when reading spilled segments back.
+    """
+
+    def __init__(self, memory_budget: Optional[int] = None, spill_dir: Optional[str] = None,
+                 chunk_rows: int = 65536):
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self.chunk_rows = chunk_rows
+        self._buffer = SegmentColumns()
+        self._row_nbytes = SegmentColumns.row_nbytes()
+        self._max_buffered = None
+        if memory_budget is not None:
+            self._max_buffered = max(1, memory_budget // self._row_nbytes)
+        self._spilled_rows = 0
+        self._db = None
+        self._db_path = None
+
+    def __len__(self) -> int:
+        return self._spilled_rows + len(self._buffer)
+
+    def __enter__(self) -> 'SegmentStore':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @property
+    def spilled(self) -> bool:
+        return self._db is not None
+
+    def append(self, row: tuple) -> None:
+        self._buffer.append(row)
+        if self._max_buffered is not None and len(self._buffer) >= self._max_buffered:
+            self._spill()
+
+    def extend(self, rows: Iterable[tuple]) -> None:
+        for row in rows:
+            self.append(row)
+
+    def append_columns(self, columns: SegmentColumns) -> None:
+        """Append a batch of already columnar rows, e.g. normalized by a worker process."""
+        self._buffer.extend(columns)
+        if self._max_buffered is not None and len(self._buffer) >= self._max_buffered:
+            self._spill()
+
+    def _open_db(self) -> None:
+        fd, self._db_path = tempfile.mkstemp(prefix='segments-', suffix='.sqlite', dir=self.spill_dir)
+        os.close(fd)
+        self._db = sqlite3.connect(self._db_path)
+        # Keep SQLite's own page cache and sort space inside the budget
+        cache_kib = max(256, min(self.memory_budget // 4, 64 * 1024 * 1024) // 1024)
+        self._db.execute('PRAGMA journal_mode=OFF')
+        self._db.execute('PRAGMA synchronous=OFF')
+        self._db.execute('PRAGMA temp_store=FILE')
+        self._db.execute(f'PRAGMA cache_size=-{cache_kib}')
+        columns = ', '.join(f'"{name}"' for name in COLUMN_NAMES)
+        self._db.execute(f'CREATE TABLE segments ({columns})')
+
+    def _spill(self) -> None:
+        if not len(self._buffer):
+            return
+        if self._db is None:
+            self._open_db()
+        placeholders = ', '.join('?' * len(COLUMNS))
+        self._db.executemany(
+            f'INSERT INTO segments VALUES ({placeholders})',
+            zip(*(self._buffer[name] for name in COLUMN_NAMES)),
+        )
+        self._db.commit()
+        self._spilled_rows += len(self._buffer)
+        self._buffer.clear()
+
+    def chunks(self) -> Iterator[SegmentColumns]:
+        """Yield the stored segments in insertion order, in bounded batches."""
+        if self._db is not None:
+            nan_columns = [i for i, (_, code) in enumerate(COLUMNS) if code == 'd']
+            cursor = self._db.execute('SELECT * FROM segments ORDER BY rowid')
+            while True:
+                rows = cursor.fetchmany(self.chunk_rows)
+                if not rows:
+                    break
+                chunk = SegmentColumns()
+                for row in rows:
+                    if None in row:
+                        # SQLite stores NaN as NULL
+                        row = list(row)
+                        for i in nan_columns:
+                            if row[i] is None:
+                                row[i] = NAN
+                    chunk.append(row)
+                yield chunk
+        if len(self._buffer):
+            yield self._buffer
+
+    def interval_stats(self) -> Tuple[int, int]:
+        """Return (distinct, total) gaps between consecutive segments, in microseconds."""
+        if self._db is None:
+            return interval_stats(self._buffer)
+
+        self._spill()
+        distinct, total = self._db.execute(
+            f'''SELECT COUNT(DISTINCT gap), COUNT(gap) FROM (
+                    SELECT CASE WHEN "end" != {MISSING} AND next_start != {MISSING}
+                                THEN next_start - "end" END AS gap
+                    FROM (SELECT "end", LEAD(start) OVER (ORDER BY rowid) AS next_start
+                          FROM segments))'''
+        ).fetchone()
+        return distinct, total
+
+    def duplicate_stats(self) -> Tuple[int, int]:
+        """Return (distinct, total) segment fingerprints, ignoring rows without one."""
+        if self._db is None:
+            return duplicate_stats(self._buffer)
+
+        self._spill()
+        distinct, total = self._db.execute(
+            'SELECT COUNT(DISTINCT fingerprint), COUNT(*) FROM segments WHERE fingerprint != 0'
+        ).fetchone()
+        return distinct, total
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        if self._db_path is not None:
+            try:
+                os.remove(self._db_path)
+            except OSError:
+                pass
+            self._db_path = None
+
+
+class DayCoverage:
+    """The UTC days a history has segments on, one byte per day.
+
+    A segment marks the days from its start to its end with one slice
+    assignment, at most ``max_segment_days`` of them (``None`` for no cap).
+    The end is exclusive, so a segment ending at midnight does not mark the
+    following day.
+    """
+
+    def __init__(self, max_segment_days: Optional[int] = MAX_SEGMENT_DAYS):
+        self.max_segment_days = max_segment_days
+        self.first_day = None
+        self.days = bytearray()
+
+    def add(self, start: int, end: int) -> None:
+        if start == MISSING or end < start:
+            return
+        if self.first_day is None:
+            self.first_day = start // _MICROS_PER_DAY
+        first = start // _MICROS_PER_DAY - self.first_day
+        last = (end - 1 if end > start else end) // _MICROS_PER_DAY - self.first_day
+        if self.max_segment_days is not None:
+            last = min(last, first + self.max_segment_days - 1)
+        if first < 0 or last >= len(self.days):
+            first, last = self._grow(first, last)
+        if first == last:
+            self.days[first] = 1
+        else:
+            self.days[first:last + 1] = b'\x01' * (last + 1 - first)
+
+    def _grow(self, first: int, last: int) -> Tuple[int, int]:
+        """Make room for day offsets ``first``..``last``; return them rebased."""
+        # Grow geometrically so out-of-order histories stay linear
+        if first < 0:
+            grow = max(-first, len(self.days))
+            self.days[0:0] = bytes(grow)
+            self.first_day -= grow
+            first += grow
+            last += grow
+        if last >= len(self.days):
+            self.days.extend(bytes(max(last + 1 - len(self.days), len(self.days))))
+        return first, last
+
+    def __len__(self) -> int:
+        return self.days.count(1)
+
+
+class CheckCounts:
+    """Valid/total tallies of every check, plus the history's time span and coverage."""
+
+    NAMES = ('time_order', 'speed', 'probabilities', 'levels', 'paths', 'intervals', 'travel',
+             'continuity', 'duplicates')
+
+    def __init__(self):
+        self.valid = dict.fromkeys(self.NAMES, 0)
+        self.total = dict.fromkeys(self.NAMES, 0)
+        self.earliest = None
+        self.latest = None
+        self.covered_days = 0
+
+    def score(self, name: str) -> float:
+        total = self.total[name]
+        return self.valid[name] / total if total > 0 else 1.0
+
+    @property
+    def time_span_days(self) -> float:
+        if self.earliest is None or self.latest is None:
+            return 0.0
+        return ((self.latest - self.earliest) / _MICROS_PER_SECOND) / 86400.0
+
+    @property
+    def coverage_score(self) -> float:
+        """Final score of a history that passes the checks: days with data, capped at 1.0."""
+        return min(self.covered_days / FULL_COVERAGE_DAYS, 1.0)
+
+
+# Columns read row by row in ``count_checks``
+_TALLIED_COLUMNS = ('start', 'end', 'flags', 'speed', 'travel_speed', 'prob_valid', 'prob_total',
+                    'level', 'confidence', 'path_valid', 'path_total')
+
+
+def count_checks(store: SegmentStore, max_speed_m_s: float, max_walk_speed: float,
+                 max_run_speed: float, level_ok: Callable[[int, float], bool],
+                 max_gap_m: float) -> CheckCounts:
+    """Tally every check over the store in one pass.
+
+    ``level_ok(level, confidence)`` decides whether an entry flagged
+    ``LEVEL_CHECKED`` passes the hierarchy level check. ``max_gap_m`` is the
+    spatial continuity tolerance.
+    """
+    counts = CheckCounts()
+    valid, total = counts.valid, counts.total
+    n = len(store)
+    if n:
+        total['time_order'] = 2 * n - 1
+    issues = 0
+    prev_end = MISSING
+    earliest = latest = None
+    coverage = DayCoverage()
+    # The last day marked, so the many segments within one day skip the call
+    day_from = day_to = 0
+    continuity = (0, NAN, NAN)
+
+    for chunk in store.chunks():
+        chunk_valid, chunk_total, continuity = continuity_stats(chunk, max_gap_m, continuity)
+        valid['continuity'] += chunk_valid
+        total['continuity'] += chunk_total
+        for start, end, flags, speed, travel_speed, prob_valid, prob_total, level, \
+                confidence, path_valid, path_total in zip(*(chunk[name] for name in _TALLIED_COLUMNS)):
+            if start != MISSING:
+                if prev_end != MISSING and start < prev_end:
+                    issues += 1
+                if earliest is None or start < earliest:
+                    earliest = start
+            if end != MISSING:
+                if start != MISSING and end < start:
+                    issues += 1
+                if latest is None or end > latest:
+                    latest = end
+            prev_end = end
+            if start != MISSING and end >= start and not (day_from <= start and end < day_to):
+                coverage.add(start, end)
+                day_from = start - start % _MICROS_PER_DAY
+                day_to = day_from + _MICROS_PER_DAY
+
+            if flags & SPEED_CHECKED:
+                total['speed'] += 1
+                if speed <= max_speed_m_s:
+                    valid['speed'] += 1
+            if flags & LEVEL_CHECKED:
+                total['levels'] += 1
+                if level_ok(level, confidence):
+                    valid['levels'] += 1
+            if flags & (WALK | RUN):
+                total['travel'] += 1
+                if (flags & WALK and travel_speed <= max_walk_speed) or \
+                   (flags & RUN and travel_speed <= max_run_speed):
+                    valid['travel'] += 1
+            valid['probabilities'] += prob_valid
+            total['probabilities'] += prob_total
+            valid['paths'] += path_valid
+            total['paths'] += path_total
+
+    valid['time_order'] = total['time_order'] - issues
+    valid['intervals'], total['intervals'] = store.interval_stats()
+    valid['duplicates'], total['duplicates'] = store.duplicate_stats()
+    counts.earliest, counts.latest = earliest, latest
+    counts.covered_days = len(coverage)
+    return counts
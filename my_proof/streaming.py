@@ -0,0 +1,298 @@
+"""Incremental JSON readers for location history exports.
+
+``json.load`` materializes the whole export before the first check runs. The
+helpers here read the file in fixed-size blocks and yield the entries of the
+history array one at a time, so only a single entry is decoded at any moment.
+
+``load_projected`` takes a field projection instead: nested dicts naming the members to
+keep, where ``True`` keeps a whole subtree and arrays are projected element by
+element. Everything else, such as the ``rawSignals`` and
+``userLocationProfile`` sections of an Android export, is skipped by scanning
+for brackets and string delimiters without building any Python objects, so
+parse time and memory follow the data the checks read rather than the file
+size.
+"""
+import json
+import re
+from typing import Any, Dict, Iterator, Optional, TextIO, Tuple, Union
+
+# Members to keep: True for a whole subtree, or a dict projecting its members
+Projection = Union[bool, Dict[str, 'Projection']]
+
+_WHITESPACE = ' \t\n\r'
+_STRING = r'"[^"\\]*(?:\\.[^"\\]*)*"'
+_STRINGS = re.compile(_STRING, re.DOTALL)
+# Everything up to the next bracket outside a string
+_SKIP_RUN = re.compile(rf'(?:[^"\[\]{{}}]+|{_STRING})*', re.DOTALL)
+# Everything up to the first string that is not closed before the end position
+_COMPLETE_RUN = re.compile(rf'(?:[^"]+|{_STRING})*', re.DOTALL)
+_NOT_BRACKET = re.compile(r'[^\[\]]+')
+_BRACKET_PAIRS = str.maketrans('{}', '[]')
+_MAX_CANCEL_PASSES = 64
+# Characters stepped through one bracket at a time when skipping a value
+_WALK_SPAN = 4096
+# Characters that can still extend a number cut off at the end of the window
+_NUMBER_TAIL = re.compile(r'[0-9.eE+-]*')
+_decoder = json.JSONDecoder()
+
+
+def _string_safe_prefix(text: str, limit: int) -> int:
+    """Length of the longest prefix of ``text[:limit]`` that does not end inside a string.
+
+    ``text`` must start outside a string.
+    """
+    head = text[:limit]
+    if '\\"' not in head:
+        # No escaped quotes, so quotes alternate between opening and closing
+        return limit if head.count('"') % 2 == 0 else head.rfind('"')
+    return _COMPLETE_RUN.match(text, 0, limit).end()
+
+
+def _bracket_balance(text: str) -> Optional[Tuple[int, int]]:
+    """Return (unmatched closing, unmatched opening) brackets of a string-safe span.
+
+    Strings are dropped, braces folded into brackets and adjacent ``[]``
+    pairs cancelled until only ``]]..[[`` remains, all with C-level string
+    methods. Returns None for nesting too deep to cancel in a few passes.
+    """
+    if '\\"' in text:
+        outside = _STRINGS.sub('', text)
+    else:
+        outside = ''.join(text.split('"')[::2])
+    brackets = _NOT_BRACKET.sub('', outside.translate(_BRACKET_PAIRS))
+    for _ in range(_MAX_CANCEL_PASSES):
+        if '[]' not in brackets:
+            closes = len(brackets) - len(brackets.lstrip(']'))
+            return closes, len(brackets) - closes
+        brackets = brackets.replace('[]', '')
+    return None
+
+
+class _BlockReader:
+    """A sliding text window over a file, refilled on demand."""
+
+    def __init__(self, fp: TextIO, block_size: int):
+        self.fp = fp
+        self.block_size = block_size
+        self.buf = ''
+        self.pos = 0
+        # Characters dropped from the front of the window so far
+        self.base = 0
+        self.eof = False
+
+    def _refill(self, size: Optional[int] = None) -> bool:
+        if self.eof:
+            return False
+        block = self.fp.read(size or self.block_size)
+        if not block:
+            self.eof = True
+            return False
+        # Drop the consumed prefix so the window stays bounded
+        self.buf = self.buf[self.pos:] + block
+        self.base += self.pos
+        self.pos = 0
+        return True
+
+    def tell(self) -> int:
+        """Offset of the read position in the file, in characters."""
+        return self.base + self.pos
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._refill():
+                raise ValueError("Unexpected end of JSON input")
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at offset {self.pos}, found {self.buf[self.pos]!r}")
+        self.pos += 1
+
+    def decode(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                # Grow the window geometrically so a value larger than a block
+                # is re-scanned O(log n) times rather than once per block
+                if not self._refill(max(self.block_size, len(self.buf) - self.pos)):
+                    raise
+                continue
+            # A number may continue past the end of the window (e.g. "12." + "5")
+            if not self.eof and _NUMBER_TAIL.fullmatch(self.buf, end) and self._refill():
+                continue
+            self.pos = end
+            return value
+
+    def skip(self) -> None:
+        """Consume one value; containers are scanned for their closing bracket, not decoded.
+
+        Brackets are balanced in bulk over growing spans of the window (see
+        ``_bracket_balance``), so Python only steps bracket by bracket through
+        the last few kilobytes before the value ends.
+        """
+        if self.peek() not in '[{':
+            self.decode()
+            return
+        self.pos += 1
+        depth = 1
+        span = _WALK_SPAN
+        while True:
+            limit = min(len(self.buf), self.pos + span)
+            text = self.buf[self.pos:limit]
+            cut = _string_safe_prefix(text, len(text))
+            if cut == 0:
+                # A string crosses the span (widen it) or the window (read on)
+                if limit < len(self.buf):
+                    span *= 2
+                elif not self._refill(max(self.block_size, len(self.buf) - self.pos)):
+                    raise ValueError("Unexpected end of JSON input")
+                continue
+            text = text[:cut]
+
+            # Halve the span while it still holds the closing bracket
+            while True:
+                balance = _bracket_balance(text)
+                if balance is not None and balance[0] < depth:
+                    break
+                head = 0
+                if balance is not None and len(text) > _WALK_SPAN:
+                    head = _string_safe_prefix(text, len(text) // 2)
+                if not head:
+                    break
+                text = text[:head]
+            if balance is not None and balance[0] < depth:
+                depth += balance[1] - balance[0]
+                self.pos += len(text)
+                span = min(span * 2, self.block_size)
+                continue
+
+            # Step through the remaining span bracket by bracket
+            end = self.pos + len(text)
+            while True:
+                self.pos = _SKIP_RUN.match(self.buf, self.pos, end).end()
+                if self.pos == end:
+                    break
+                depth += 1 if self.buf[self.pos] in '[{' else -1
+                self.pos += 1
+                if depth == 0:
+                    return
+
+    def decode_projected(self, fields: Projection) -> Any:
+        """Decode one value, keeping only the members named by ``fields``."""
+        if fields is True:
+            return self.decode()
+        char = self.peek()
+        if char == '{':
+            obj = {}
+            for key in self.iter_object():
+                member_fields = fields.get(key)
+                if member_fields is None:
+                    self.skip()
+                else:
+                    obj[key] = self.decode_projected(member_fields)
+            return obj
+        if char == '[':
+            return list(self.iter_array(fields=fields))
+        return self.decode()
+
+    def iter_array(self, decode: bool = False, fields: Optional[Projection] = None) -> Iterator[Any]:
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            if fields is not None:
+                yield self.decode_projected(fields)
+            elif decode:
+                yield self.decode()
+            else:
+                self.skip()
+                yield None
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect(']')
+            return
+
+    def iter_object(self, skip_values: bool = False) -> Iterator[str]:
+        """Yield member keys; unless ``skip_values``, the caller consumes each value."""
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.decode()
+            self.expect(':')
+            if skip_values:
+                self.skip()
+            yield key
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect('}')
+            return
+
+
+def detect_format(path: str) -> Optional[str]:
+    """Return 'ios' for a top-level array, 'android' for an object, else None."""
+    with open(path, 'r', encoding='utf-8') as f:
+        try:
+            char = _BlockReader(f, 4096).peek()
+        except ValueError:
+            return None
+    return {'[': 'ios', '{': 'android'}.get(char)
+
+
+def iter_history(path: str, key: Optional[str] = None, block_size: int = 1 << 20) -> Iterator[Any]:
+    """Yield the entries of a history array without loading the whole file.
+
+    Args:
+        path: JSON file to read.
+        key: Member of the top-level object holding the array (e.g.
+            'semanticSegments'); ``None`` when the file itself is the array.
+        block_size: Characters read from the file per refill.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        reader = _BlockReader(f, block_size)
+        if key is None:
+            yield from reader.iter_array(decode=True)
+            return
+        for member in reader.iter_object():
+            if member == key:
+                yield from reader.iter_array(decode=True)
+                return
+            reader.skip()
+        raise KeyError(key)
+
+
+def history_offset(path: str, key: Optional[str] = None, block_size: int = 1 << 20) -> int:
+    """Byte offset of the '[' opening a history array (see ``iter_history`` for ``key``)."""
+    # Latin-1 maps every byte to one character, so character offsets are byte
+    # offsets, and UTF-8 continuation bytes never look like JSON punctuation
+    with open(path, 'r', encoding='latin-1') as f:
+        reader = _BlockReader(f, block_size)
+        if key is not None:
+            for member in reader.iter_object():
+                if member == key:
+                    break
+                reader.skip()
+            else:
+                raise KeyError(key)
+        if reader.peek() != '[':
+            raise ValueError(f"Expected an array at offset {reader.tell()}")
+        return reader.tell()
+
+
+def load_projected(path: str, fields: Projection, block_size: int = 1 << 20) -> Any:
+    """Load a JSON file, keeping only the members named by ``fields``.
+
+    Example:
+        load_projected(path, {'semanticSegments': {'startTime': True, 'endTime': True}})
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return _BlockReader(f, block_size).decode_projected(fields)
@@ -0,0 +1,122 @@
+"""Threshold sweeps over one normalized history.
+
+Calibrating ``max_speed_m_s``, ``max_walk_speed``, ``max_run_speed`` and
+``allowed_hierarchy_levels`` by re-running ``validate()`` per combination
+re-normalizes and re-scores the whole history every time. ``ThresholdSweep``
+instead reads the segment columns once: checks that do not depend on those
+parameters are tallied a single time, speeds are sorted so each speed
+threshold is answered with a binary search, and hierarchy levels are reduced
+to a histogram. Every grid point then costs O(log n) regardless of history
+size.
+
+Example:
+    sweep = ThresholdSweep(LocationHistoryValidator(), entries)
+    results = sweep.evaluate({'max_speed_m_s': [30, 44.44, 60],
+                              'allowed_hierarchy_levels': [[0], [0, 1, 2]]})
+"""
+from bisect import bisect_right
+from collections import Counter
+from itertools import product
+from typing import Any, Dict, List, Sequence
+
+from my_proof.segments import LEVEL_CHECKED, RUN, SPEED_CHECKED, WALK, CheckCounts, SegmentStore
+
+PARAMETERS = ('max_speed_m_s', 'max_walk_speed', 'max_run_speed', 'allowed_hierarchy_levels')
+
+
+class ThresholdSweep:
+    """Precomputed, parameter-free view of a history for fast threshold grids.
+
+    Args:
+        validator: A ``LocationHistoryValidator`` or
+            ``AndroidLocationHistoryValidator``; its current thresholds are the
+            defaults for parameters a grid leaves out.
+        data: A list of entries, a ``SegmentStore`` or a mapped segment cache.
+    """
+
+    def __init__(self, validator, data):
+        self.validator = validator
+        if isinstance(data, (list, tuple)):
+            with validator.to_store(data) as store:
+                self._precompute(store)
+        else:
+            self._precompute(data)
+
+    def _precompute(self, store: SegmentStore) -> None:
+        # Parameter-independent checks, time span, coverage and (for Android) levels
+        self.base = self.validator.tally(store)
+
+        speeds, walk_speeds, run_speeds, both_speeds = [], [], [], []
+        levels = Counter()
+        for chunk in store.chunks():
+            for flags, speed, travel_speed, level in zip(
+                    chunk['flags'], chunk['speed'], chunk['travel_speed'], chunk['level']):
+                if flags & SPEED_CHECKED:
+                    speeds.append(speed)
+                if flags & LEVEL_CHECKED:
+                    levels[level] += 1
+                mode = flags & (WALK | RUN)
+                if mode == WALK:
+                    walk_speeds.append(travel_speed)
+                elif mode == RUN:
+                    run_speeds.append(travel_speed)
+                elif mode:
+                    both_speeds.append(travel_speed)
+
+        # NaN never satisfies a threshold, so it is kept out of the sorted arrays
+        self._speeds = sorted(s for s in speeds if s == s)
+        self._walk_speeds = sorted(s for s in walk_speeds if s == s)
+        self._run_speeds = sorted(s for s in run_speeds if s == s)
+        self._both_speeds = sorted(s for s in both_speeds if s == s)
+        self._levels = levels
+
+    def counts(self, max_speed_m_s: float, max_walk_speed: float, max_run_speed: float,
+               allowed_hierarchy_levels: Sequence[int]) -> CheckCounts:
+        """Return the check tallies for one parameter combination."""
+        counts = CheckCounts()
+        counts.valid.update(self.base.valid)
+        counts.total.update(self.base.total)
+        counts.earliest, counts.latest = self.base.earliest, self.base.latest
+        counts.covered_days = self.base.covered_days
+
+        counts.valid['speed'] = bisect_right(self._speeds, max_speed_m_s)
+        counts.valid['travel'] = (
+            bisect_right(self._walk_speeds, max_walk_speed)
+            + bisect_right(self._run_speeds, max_run_speed)
+            + bisect_right(self._both_speeds, max(max_walk_speed, max_run_speed))
+        )
+        if self.validator.data_format == 'ios':
+            counts.valid['levels'] = sum(self._levels[level] for level in set(allowed_hierarchy_levels))
+        return counts
+
+    def evaluate(self, grid: Dict[str, Sequence[Any]]) -> List[Dict[str, Any]]:
+        """Score every point of the cartesian product of ``grid``.
+
+        Args:
+            grid: Maps parameter names from ``PARAMETERS`` to the values to try.
+
+        Returns:
+            One dict per grid point with the 'params' used, the per-check
+            'checks' scores and the final 'score' (-1 when the checks fail,
+            exactly as ``validate()`` would return).
+        """
+        unknown = set(grid) - set(PARAMETERS)
+        if unknown:
+            raise ValueError(f"Unknown sweep parameters: {', '.join(sorted(unknown))}")
+
+        axes = [grid.get(name, [getattr(self.validator, name)]) for name in PARAMETERS]
+        results = []
+        for values in product(*axes):
+            params = dict(zip(PARAMETERS, values))
+            checks = self.validator.check_results(self.counts(**params))
+            if sum(value for _, value in checks) < len(checks) * 0.1:
+                score = -1
+            else:
+                score = self.base.coverage_score
+            results.append({'params': params, 'checks': dict(checks), 'score': score})
+        return results
+
+
+def sweep_thresholds(validator, data, grid: Dict[str, Sequence[Any]]) -> List[Dict[str, Any]]:
+    """Shortcut for ``ThresholdSweep(validator, data).evaluate(grid)``."""
+    return ThresholdSweep(validator, data).evaluate(grid)
@@ -1,6 +1,4 @@
-from typing import List, Dict, Any
-
-from my_proof.aws_interaction import download_json_from_s3
+from typing import List, Dict, Any, Optional
 
 MINIMUM_TOTAL_AVERAGE_TIME=15 #minimum average time to anwser a questsion
 MINIMUM_CHARACTER_TIME=0.05 #minimum time to anwsers per characters https://irisreading.com/what-is-the-average-reading-speed/
@@ -226,10 +224,14 @@ def Model_Bias(data_list: List[Dict[str, Any]]) -> Dict[str, Any]:
             'comments': [f'An error occurred while analyzing model bias: {str(e)}']
         }
     
-def Poison_Consistency(data_list: List[Dict[str, Any]], aws_access_key_id: str, aws_secret_access_key: str) -> Dict[str, Any]:
+def Poison_Consistency(data_list: List[Dict[str, Any]], aws_access_key_id: str, aws_secret_access_key: str,
+                       poisoned_data: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
     try:
-        # Download poisoned data from S3
-        poisoned_data = download_json_from_s3('vanatensorpoisondata', 'poisin.json', aws_access_key_id, aws_secret_access_key)
+        if poisoned_data is None:
+            from my_proof.aws_interaction import download_json_from_s3
+
+            # Download poisoned data from S3 unless it was prefetched (see remote_fetch.RemoteFetches)
+            poisoned_data = download_json_from_s3('vanatensorpoisondata', 'poisin.json', aws_access_key_id, aws_secret_access_key)
         if not poisoned_data:
             return {
                 'score': 0.0,